@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# asyncio front end to extraction: reads, decompression and writes of
+# different files overlap, the blocking and CPU-bound parts run in an
+# executor, and at most max_inflight bytes are held in memory at once.
+#
+#   async for entry in extract_async('package.sis', 'out'):
+#       print(entry.name, entry.size)
+
+import asyncio
+import os
+from collections import namedtuple
+
+from util.output import get_output
+
+SIS_MAGIC = 0x10201A7A.to_bytes(4, 'little')
+E32_MAGIC = b'EPOC'
+
+# name within the target, size written, and the SISFileDescription (or
+# the E32ImageHeader) it came from
+Entry = namedtuple('Entry', 'name size description')
+
+
+class ByteBudget:
+    # Counting semaphore over bytes. A single request larger than the
+    # whole budget is let through alone rather than blocking forever.
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, n):
+        n = min(n, self.limit)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.used + n <= self.limit)
+            self.used += n
+        return n
+
+    async def release(self, n):
+        async with self._cond:
+            self.used -= n
+            self._cond.notify_all()
+
+
+def _sniff(path):
+    with open(path, 'rb') as fp:
+        start = fp.read(32)
+    if start[:4] == SIS_MAGIC:
+        return 'sisfile'
+    if start[16:20] == E32_MAGIC:
+        return 'e32exe'
+    raise ValueError(f"{path}: neither a SIS package nor an E32 image")
+
+
+def _sis_layout(path):
+    # controller and file payload locations, without reading any payload
+    from sisfile import SymbianFileHeader, parse_controller, iter_file_data
+    with open(path, 'rb') as fp:
+        SymbianFileHeader(fp)
+        contents = parse_controller(fp)
+        entries = list(iter_file_data(fp))
+    return contents, entries
+
+
+def _e32_objcopy(path, target):
+    from e32exe import E32ImageHeader, objcopy
+    with open(path, 'rb') as fp:
+        header = E32ImageHeader(fp)
+        objcopy(fp, header, target)
+    return header
+
+
+def _pread(fd, length, offset):
+    buf = os.pread(fd, length, offset)
+    if len(buf) != length:
+        raise EOFError("source ended prematurely")
+    return buf
+
+
+async def _extract_one(loop, executor, budget, stop, fd, output, f, entry):
+    # stop is checked between stages instead of cancelling: an executor
+    # call cannot be interrupted, and must not outlive fd
+    from sisfile import TCompressionAlgorithm, target_name, inflate
+    name = target_name(f)
+    held = await budget.acquire(entry.length + entry.size)
+    try:
+        if stop.is_set():
+            return None
+        data = await loop.run_in_executor(
+            executor, _pread, fd, entry.length, entry.offset)
+        if entry.algorithm == TCompressionAlgorithm.SISCompressedDeflate:
+            if stop.is_set():
+                return None
+            data = await loop.run_in_executor(executor, inflate, data)
+        if stop.is_set():
+            return None
+        await loop.run_in_executor(executor, output.add, name, data)
+    finally:
+        await budget.release(held)
+    return Entry(name, len(data), f)
+
+
+async def extract_async(path, target, max_inflight=64 << 20, executor=None):
+    # Yields an Entry per extracted file, in completion order. target is
+    # a directory or an output backend; executor defaults to the loop's.
+    # Many packages can be extracted concurrently, each with its budget.
+    loop = asyncio.get_running_loop()
+    output = get_output(target)
+    kind = await loop.run_in_executor(executor, _sniff, path)
+    if kind == 'e32exe':
+        header = await loop.run_in_executor(
+            executor, _e32_objcopy, path, output)
+        yield Entry('uncompressed.exe', header.iCodeOffset
+                    + header.iUncompressedSize, header)
+        return
+
+    contents, entries = await loop.run_in_executor(
+        executor, _sis_layout, path)
+    files = contents.Controller.CompressedData.InstallBlock.Files.Contents
+    # like extract_files, only the first data unit is extracted
+    payloads = {e.index: e for e in entries if e.unit == 0}
+    budget = ByteBudget(max_inflight)
+    stop = asyncio.Event()
+    fd = os.open(path, os.O_RDONLY)
+    tasks = []
+    try:
+        for f in files:
+            tasks.append(asyncio.ensure_future(_extract_one(
+                loop, executor, budget, stop, fd, output, f,
+                payloads[f.FileIndex])))
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # consumer gone or a file failed: let the rest wind down
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        os.close(fd)
+
+
+async def extract_all(paths, target_dirs, max_inflight=64 << 20,
+                      executor=None):
+    # extract several packages concurrently, one target each
+    async def drain(path, target):
+        return [entry async for entry in
+                extract_async(path, target, max_inflight, executor)]
+    return await asyncio.gather(*(drain(path, target)
+                                  for path, target in zip(paths, target_dirs)))
+
+
+if __name__ == '__main__':
+    import sys
+    for entries in asyncio.run(extract_all(sys.argv[1::2], sys.argv[2::2])):
+        for entry in entries:
+            print(entry.name, entry.size)
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+
+# Synthetic inputs for the benchmarks: SIS packages built field by field
+# after the SIS format specification, and E32 images compressed with a
+# reference encoder for the E32 deflate variant that E32HuffmanStream reads.
+
+import argparse
+import hashlib
+import heapq
+import os
+import random
+import struct
+import zlib
+
+from e32exe import (
+    E32HuffmanStream,
+    TCompression,
+    huffman_decoding,
+    uidcrc,
+)
+from sisfile import TField
+from util.binfile import UInt32
+from util.crc import crc16
+
+
+# -- SIS -------------------------------------------------------------------
+
+def pad4(b):
+    return b + bytes(-len(b) % 4)
+
+
+def sisfield(tp, payload, typed=True):
+    n = len(payload)
+    if n < 0x80000000:
+        length = struct.pack('<I', n)
+    else:
+        length = struct.pack('<II', n & 0x7fffffff | 0x80000000, n >> 31)
+    head = struct.pack('<i', tp) if typed else b''
+    return pad4(head + length + payload)
+
+
+def sisarray(tp, elements):
+    return sisfield(TField.SISArray, struct.pack('<I', tp) + b''.join(
+        sisfield(tp, e, typed=False) for e in elements))
+
+
+def sisstring(s, typed=True):
+    return sisfield(TField.SISString, s.encode('utf-16-le'), typed)
+
+
+def siscompressed(payload, deflate=True, level=6):
+    data = zlib.compress(payload, level) if deflate else payload
+    return sisfield(TField.SISCompressed,
+                    struct.pack('<IQ', int(deflate), len(payload)) + data)
+
+
+def build_sis(files, uid3=0x20001234, deflate=True, level=6):
+    # files: list of (target path, contents)
+    sf = sisfield
+    info = sf(TField.SISInfo, b''.join([
+        sf(TField.SISUid, struct.pack('<i', uid3)),
+        sisstring('Benchmark Vendor'),
+        sisarray(TField.SISString, ['Benchmark'.encode('utf-16-le')]),
+        sisarray(TField.SISString, ['Vendor'.encode('utf-16-le')]),
+        sf(TField.SISVersion, struct.pack('<iii', 1, 0, 0)),
+        sf(TField.SISDateTime,
+           sf(TField.SISDate, struct.pack('<HBB', 2010, 0, 1))
+           + sf(TField.SISTime, bytes([12, 0, 0]))),
+        bytes([0, 0]),  # InstallType, InstallFlags
+    ]))
+    descriptions = []
+    for idx, (target, data) in enumerate(files):
+        digest = hashlib.sha1(data).digest()
+        descriptions.append(b''.join([
+            sisstring(target),
+            sisstring(''),
+            sf(TField.SISHash, struct.pack('<I', 1)  # EHashAlgSHA1
+               + sf(TField.SISBlob, digest)),
+            struct.pack('<IIQQI', 1, 0, len(data), len(data), idx),
+        ]))
+    controller = sf(TField.SISController, b''.join([
+        info,
+        sf(TField.SISSupportedOptions, sisarray(TField.SISSupportedOption, [])),
+        sf(TField.SISSupportedLanguages, sisarray(TField.SISLanguage,
+                                                  [struct.pack('<I', 1)])),
+        sf(TField.SISPrerequisites, sisarray(TField.SISDependency, [])
+           + sisarray(TField.SISDependency, [])),
+        sf(TField.SISProperties, sisarray(TField.SISProperty, [])),
+        sf(TField.SISInstallBlock,
+           sisarray(TField.SISFileDescription, descriptions)
+           + sisarray(TField.SISController, [])
+           + sisarray(TField.SISIf, [])),
+        sf(TField.SISSignatureCertificateChain,
+           sisarray(TField.SISSignature, [])
+           + sf(TField.SISCertificateChain, sf(TField.SISBlob, b''))),
+        sf(TField.SISDataIndex, struct.pack('<I', 0)),
+    ]))
+    controller = siscompressed(controller, deflate, level)
+    filedata = [siscompressed(data, deflate, level) for _, data in files]
+    data = sf(TField.SISData, sisarray(TField.SISDataUnit, [
+        sisarray(TField.SISFileData, filedata)]))
+    contents = sf(TField.SISContents, b''.join([
+        sf(TField.SISControllerChecksum, struct.pack('<H', crc16(controller))),
+        sf(TField.SISDataChecksum, struct.pack('<H', crc16(data))),
+        controller,
+        data,
+    ]))
+    return struct.pack('<iiii', 0x10201A7A, 0, uid3, 0) + contents
+
+
+def payload(rng, size, redundancy=0.5):
+    # bytes that compress roughly like code: repeated words between noise
+    words = [rng.randbytes(rng.randrange(4, 32)) for _ in range(64)]
+    out = bytearray()
+    while len(out) < size:
+        if rng.random() < redundancy:
+            out += rng.choice(words)
+        else:
+            out += rng.randbytes(rng.randrange(1, 16))
+    return bytes(out[:size])
+
+
+# -- E32 deflate -----------------------------------------------------------
+
+class BitWriter:
+    # most significant bit first, like E32HuffmanStream reads them
+    def __init__(self):
+        self._acc = 0
+        self._n = 0
+        self.out = bytearray()
+
+    def write(self, value, nbits):
+        self._acc = self._acc << nbits | value
+        self._n += nbits
+        while self._n >= 8:
+            self._n -= 8
+            self.out.append(self._acc >> self._n & 0xff)
+        self._acc &= (1 << self._n) - 1
+
+    def getvalue(self):
+        if self._n:
+            self.write(0, 8 - self._n)
+        return bytes(self.out)
+
+
+def code_lengths(freqs, maxlen=26):
+    symbols = [s for s, f in enumerate(freqs) if f]
+    lengths = [0] * len(freqs)
+    if len(symbols) == 1:
+        lengths[symbols[0]] = 1
+        return lengths
+    while True:
+        heap = [(freqs[s], s, (s,)) for s in symbols]
+        heapq.heapify(heap)
+        depth = dict.fromkeys(symbols, 0)
+        while len(heap) > 1:
+            f1, k1, s1 = heapq.heappop(heap)
+            f2, k2, s2 = heapq.heappop(heap)
+            for s in s1 + s2:
+                depth[s] += 1
+            heapq.heappush(heap, (f1 + f2, min(k1, k2), s1 + s2))
+        if max(depth.values()) <= maxlen:
+            break
+        freqs = [(f + 1) // 2 if f else 0 for f in freqs]
+    for s, d in depth.items():
+        lengths[s] = d
+    return lengths
+
+
+def canonical_codes(lengths):
+    # same assignment as E32HuffmanStream.HuffmanSubTree: by length, then
+    # by symbol, leftmost first
+    codes = {}
+    code = prev = 0
+    for length, sym in sorted((l, s) for s, l in enumerate(lengths) if l):
+        code <<= length - prev
+        codes[sym] = code, length
+        code += 1
+        prev = length
+    if len(codes) == 1:
+        # single code: the decoder accepts either bit
+        codes = {sym: (0, 1) for sym in codes}
+    return codes
+
+
+def split_value(v):
+    # length/distance value -> (code, extra bits, number of extra bits)
+    if v < 8:
+        return v, 0, 0
+    xtra = v.bit_length() - 3
+    return 4 * (xtra + 1) + (v >> xtra & 3), v & ((1 << xtra) - 1), xtra
+
+
+def lz77(data, window=E32HuffmanStream.KDeflateMaxDistance,
+         maxlen=E32HuffmanStream.KDeflateMaxLength):
+    # greedy, one candidate per 3-byte prefix: a reference, not a good packer
+    last = {}
+    pos = 0
+    n = len(data)
+    minlen = E32HuffmanStream.KDeflateMinLength
+    while pos < n:
+        key = data[pos:pos + minlen]
+        cand = last.get(key)
+        last[key] = pos
+        length = 0
+        if cand is not None and pos - cand <= window and len(key) == minlen:
+            limit = min(maxlen, n - pos)
+            while length < limit and data[cand + length] == data[pos + length]:
+                length += 1
+        if length >= minlen:
+            yield length, pos - cand
+            pos += length
+        else:
+            yield data[pos], None
+            pos += 1
+
+
+def e32deflate(data):
+    S = E32HuffmanStream
+    tokens = list(lz77(data))
+    llfreq = [0] * S.ELitLens
+    dfreq = [0] * S.EDistances
+    for val, dist in tokens:
+        if dist is None:
+            llfreq[val] += 1
+        else:
+            llfreq[S.ELiterals + split_value(val - S.KDeflateMinLength)[0]] += 1
+            dfreq[split_value(dist - 1)[0]] += 1
+    llfreq[S.EEos] = 1
+    if not any(dfreq):
+        dfreq[0] = 1  # the decoder needs a distance tree all the same
+    lengths = code_lengths(llfreq) + code_lengths(dfreq)
+
+    bits = BitWriter()
+    meta = {v: (k - (1 << k.bit_length() - 1), k.bit_length() - 1)
+            for k, v in huffman_decoding().items()}
+
+    def runlength(rl):
+        # bijective base 2, most significant digit first, digits are codes 0/1
+        digits = []
+        while rl:
+            digit = 2 - (rl & 1)
+            digits.append(digit - 1)
+            rl = (rl - digit) >> 1
+        for c in reversed(digits):
+            bits.write(*meta[c])
+
+    mtf = list(range(28))  # mtf[0] is always the previous length
+    rl = 0
+    for length in lengths:
+        if length == mtf[0]:
+            rl += 1
+            continue
+        runlength(rl)
+        rl = 0
+        j = mtf.index(length)
+        bits.write(*meta[j + 1])
+        mtf.insert(0, mtf.pop(j))
+    runlength(rl)
+
+    llcodes = canonical_codes(lengths[:S.ELitLens])
+    dcodes = canonical_codes(lengths[S.ELitLens:])
+    for val, dist in tokens:
+        if dist is None:
+            bits.write(*llcodes[val])
+            continue
+        code, extra, xtra = split_value(val - S.KDeflateMinLength)
+        bits.write(*llcodes[S.ELiterals + code])
+        bits.write(extra, xtra)
+        code, extra, xtra = split_value(dist - 1)
+        bits.write(*dcodes[code])
+        bits.write(extra, xtra)
+    bits.write(*llcodes[S.EEos])
+    return bits.getvalue()
+
+
+# -- E32 images ------------------------------------------------------------
+
+E32HEADER = struct.Struct('<4I5I2II6i3IiIii5I2HI4IIIHB')
+
+
+def build_e32(rng, code_size=0x4000, data_size=0x400, dlls=('euser.dll',),
+              imports_per_dll=16, compressed=True, exports=0):
+    code = bytearray(payload(rng, code_size & ~3, 0.7))
+    data = payload(rng, data_size & ~3, 0.3)
+
+    # import section: blocks, then the NUL terminated DLL names
+    offsets = sorted(rng.sample(range(0, len(code), 4),
+                                len(dlls) * imports_per_dll))
+    blocks = b''
+    names = b''
+    namebase = 4 + sum(8 + 4 * imports_per_dll for _ in dlls)
+    for i, dll in enumerate(dlls):
+        imps = offsets[i * imports_per_dll:(i + 1) * imports_per_dll]
+        for n, off in enumerate(imps):
+            code[off:off + 4] = (rng.randrange(4) << 12 | n + 1).to_bytes(4, 'little')
+        blocks += struct.pack(f'<Ii{len(imps)}I', namebase + len(names),
+                              len(imps), *imps)
+        names += dll.encode('ascii') + b'\0'
+    imports = pad4(struct.pack('<i', len(blocks) + len(names))
+                   + blocks + names)
+
+    def relocs(size, rtype):
+        section = b''
+        count = 0
+        for page in range(0, size, 0x1000):
+            entries = [rtype | off for off in range(0, min(0x1000, size - page), 64)]
+            if len(entries) % 2:
+                entries.append(0)
+            count += len(entries)
+            section += struct.pack(f'<II{len(entries)}H', page,
+                                   8 + 2 * len(entries), *entries)
+        # iSize as E32RelocSection reads it: the blocks only
+        return struct.pack('<ii', len(section), count) + section
+
+    # export directory at the end of the code section, after its count
+    text_size = len(code) - 0x100
+    exportdir = 0
+    if exports:
+        addrs = [0x8000 + rng.randrange(0, text_size, 4)
+                 for _ in range(exports)]
+        exportdir = len(code) + 4
+        code += struct.pack(f'<I{exports}I', exports, *addrs)
+
+    coderel = relocs(len(code), 0x1000)
+    datarel = relocs(len(data), 0x2000)
+
+    hsize = E32HEADER.size + 1  # one byte of iExportDesc
+    codeoff = hsize
+    dataoff = codeoff + len(code)
+    importoff = dataoff + len(data)
+    coderelocoff = importoff + len(imports)
+    datarelocoff = coderelocoff + len(coderel)
+    body = bytes(code) + data + imports + coderel + datarel
+
+    uid1, uid2, uid3 = 0x10000079, 0x1000008d, 0x20001234
+    u = [UInt32(x) for x in (uid1, uid2, uid3)]
+    ctype = TCompression.KUidCompressionDeflate if compressed else 0
+    header = E32HEADER.pack(
+        uid1, uid2, uid3, uidcrc(*u), int.from_bytes(b'EPOC', 'little'),
+        0, 0x000a0000, ctype, 0x00020001,  # crc, version, tools version
+        0, 0, 0,  # time lo, time hi, flags
+        len(code), len(data), 0x1000, 0x100000, 0x2000, 0,
+        0, 0x8000, 0x400000,  # entry point, code and data base
+        len(dlls), exportdir and codeoff + exportdir, exports, text_size,
+        codeoff, dataoff, importoff, coderelocoff, datarelocoff,
+        0x350, 0x2001, len(body),  # priority, ECpuArmV5
+        0, 0, 0, 0, 0, 0,  # security info, exception descriptor, spare
+        1, 0) + b'\0'
+    assert len(header) == hsize
+    if compressed:
+        return header + e32deflate(body)
+    return header + body
+
+
+# -- corpus ----------------------------------------------------------------
+
+def write_corpus(outdir, packages=10, files=20, size=64 << 10, deflate=True,
+                 images=10, image_size=64 << 10, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(outdir, exist_ok=True)
+    paths = []
+    for p in range(packages):
+        fls = [(f'c:\\sys\\bin\\file{p}_{i}.dll', payload(rng, size))
+               for i in range(files)]
+        path = os.path.join(outdir, f'package{p}.sis')
+        with open(path, 'wb') as fp:
+            fp.write(build_sis(fls, uid3=0x20000000 + p, deflate=deflate))
+        paths.append(path)
+    for i in range(images):
+        path = os.path.join(outdir, f'image{i}.dll')
+        with open(path, 'wb') as fp:
+            fp.write(build_e32(rng, image_size, image_size // 16,
+                               ('euser.dll', 'efsrv.dll'), exports=64))
+        paths.append(path)
+    return paths
+
+
+def main():
+    par = argparse.ArgumentParser(description="Write a synthetic corpus")
+    par.add_argument('outdir')
+    par.add_argument('--packages', type=int, default=10)
+    par.add_argument('--files', type=int, default=20,
+                     help="files per package")
+    par.add_argument('--size', type=int, default=64 << 10,
+                     help="bytes per packaged file")
+    par.add_argument('--no-compress', dest='deflate', action='store_false',
+                     help="store package contents uncompressed")
+    par.add_argument('--images', type=int, default=10)
+    par.add_argument('--image-size', type=int, default=64 << 10)
+    par.add_argument('--seed', type=int, default=0)
+    arg = par.parse_args()
+    for path in write_corpus(arg.outdir, arg.packages, arg.files, arg.size,
+                             arg.deflate, arg.images, arg.image_size,
+                             arg.seed):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,668 @@
+#!/usr/bin/env python3
+
+# Benchmarks for the decoders and the extraction paths, on synthetic inputs
+# from bench.corpus. Every benchmark runs in a child process of its own so
+# that its peak RSS can be reported; results are printed as JSON.
+#
+#   python3 -m bench.run [-o results.json] [--scale 4] [name ...]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+from bench import corpus
+
+BENCHMARKS = {}
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def benchmark(func):
+    # func(scale) -> (bytes processed per run, run callable)
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@benchmark
+def bits(scale):
+    from util.bitstream import Bits
+    data = random.Random(0).randbytes(scale << 16)
+
+    def run():
+        b = Bits()
+        b.feed(data)
+        for _ in b.iterbits():
+            pass
+    return len(data), run
+
+
+def _inflate(compressed, size):
+    # the objcopy path: straight into a preallocated buffer
+    from e32exe import E32HuffmanStream
+    h = E32HuffmanStream()
+    h.feed(compressed)
+    out = bytearray(size)
+    h.decode_into(out)
+    return out
+
+
+@benchmark
+def huffman_decode(scale):
+    data = corpus.payload(random.Random(0), scale << 16, 0.2)
+    compressed = corpus.e32deflate(data)
+    return len(data), lambda: _inflate(compressed, len(data))
+
+
+@benchmark
+def lz_window(scale):
+    # almost nothing but back references
+    data = corpus.payload(random.Random(0), scale << 16, 0.98)
+    compressed = corpus.e32deflate(data)
+    return len(data), lambda: _inflate(compressed, len(data))
+
+
+@benchmark
+def crc16(scale):
+    from e32exe import crc16
+    data = random.Random(0).randbytes(scale << 18)
+    return len(data), lambda: crc16(data)
+
+
+@benchmark
+def zlib_reader(scale):
+    from util.binfile import ZlibReader
+    data = corpus.payload(random.Random(0), scale << 18)
+    compressed = zlib.compress(data)
+
+    def run():
+        reader = ZlibReader(io.BytesIO(compressed))
+        while reader.read(4096):
+            pass
+    return len(data), run
+
+
+@benchmark
+def e32_header(scale):
+    from e32exe import E32ImageHeader
+    image = corpus.build_e32(random.Random(0), 0x1000, 0x100)
+    header = image[:0x9c]
+    count = 200 * scale
+
+    def run():
+        for _ in range(count):
+            E32ImageHeader(io.BytesIO(header))
+    return count * len(header), run
+
+
+@benchmark
+def sis_header(scale):
+    # the controller of a package with many files, no file data to speak of
+    from sisfile import SymbianFileHeader, parse_contents
+    files = [(f'c:\\sys\\bin\\f{i}.dll', b'x') for i in range(50 * scale)]
+    package = corpus.build_sis(files)
+
+    def run():
+        fp = io.BytesIO(package)
+        SymbianFileHeader(fp)
+        parse_contents(fp)
+    return len(package), run
+
+
+def _controller(scale):
+    from sisfile import SymbianFileHeader, parse_controller
+    files = [(f'c:\\sys\\bin\\f{i}.dll', b'x') for i in range(50 * scale)]
+    fp = io.BytesIO(corpus.build_sis(files))
+    SymbianFileHeader(fp)
+    return parse_controller(fp)
+
+
+@benchmark
+def tree_encode(scale):
+    from util import treecodec
+    tree = _controller(scale)
+    size = len(treecodec.dumps(tree))
+    return size, lambda: treecodec.dumps(tree)
+
+
+@benchmark
+def tree_decode(scale):
+    from util import treecodec
+    data = treecodec.dumps(_controller(scale))
+    return len(data), lambda: treecodec.loads(data)
+
+
+@benchmark
+def array_decode(scale):
+    from util.binfile import Array, UInt32
+    data = random.Random(0).randbytes(scale << 14)
+    tp = Array[UInt32]
+    return len(data), lambda: tp((io.BytesIO(data), len(data)))
+
+
+def _extract_fixture(scale):
+    # the package every extract_* benchmark extracts, and the bytes of
+    # file data in it
+    rng = random.Random(0)
+    files = [(f'c:\\sys\\bin\\f{i}.dll', corpus.payload(rng, 64 << 10))
+             for i in range(4 * scale)]
+    return corpus.build_sis(files), sum(len(data) for _, data in files)
+
+
+@benchmark
+def extract_sis(scale):
+    from sisfile import SymbianFileHeader, extract_files
+    package, size = _extract_fixture(scale)
+    target = tempfile.mkdtemp(prefix='bench')
+
+    def run():
+        fp = io.BytesIO(package)
+        extract_files(fp, SymbianFileHeader(fp), target)
+    return size, run
+
+
+@benchmark
+def extract_verify(scale):
+    # extract_sis plus SHA-1 checks: should cost about the same
+    from sisfile import SymbianFileHeader, Verifier, extract_files
+    package, size = _extract_fixture(scale)
+    target = tempfile.mkdtemp(prefix='bench')
+
+    def run():
+        fp = io.BytesIO(package)
+        verifier = Verifier()
+        extract_files(fp, SymbianFileHeader(fp), target, verify=verifier)
+        assert verifier.finish()
+    return size, run
+
+
+@benchmark
+def extract_tar(scale):
+    # straight into a tar archive in memory, no loose files
+    from sisfile import SymbianFileHeader, extract_files
+    from util.output import TarOutput
+    package, size = _extract_fixture(scale)
+
+    def run():
+        fp = io.BytesIO(package)
+        with TarOutput(io.BytesIO()) as tar:
+            extract_files(fp, SymbianFileHeader(fp), tar)
+    return size, run
+
+
+@benchmark
+def extract_stream(scale):
+    # as if from a pipe: one forward pass through util.stream
+    from sisfile import SymbianFileHeader, extract_files
+    from util.stream import ForwardReader
+    package, size = _extract_fixture(scale)
+    target = tempfile.mkdtemp(prefix='bench')
+
+    def run():
+        fp = ForwardReader(io.BytesIO(package))
+        extract_files(fp, SymbianFileHeader(fp), target)
+    return size, run
+
+
+@benchmark
+def extract_async(scale):
+    import asyncio
+    from asyncextract import extract_async
+    data, size = _extract_fixture(scale)
+    target = tempfile.mkdtemp(prefix='bench')
+    package = os.path.join(target, 'package.sis')
+    with open(package, 'wb') as fp:
+        fp.write(data)
+
+    async def drain():
+        async for _ in extract_async(package, target):
+            pass
+    return size, lambda: asyncio.run(drain())
+
+
+@benchmark
+def e32_decompress(scale):
+    from e32exe import E32ImageHeader
+    image = corpus.build_e32(random.Random(0), scale << 15, scale << 11)
+
+    def run():
+        fp = io.BytesIO(image)
+        header = E32ImageHeader(fp)
+        fp.seek(header.iCodeOffset)
+        _inflate(fp.read(), header.iUncompressedSize)
+    return E32ImageHeader(io.BytesIO(image)).iUncompressedSize, run
+
+
+@benchmark
+def e32_sections(scale):
+    # load_image and section parsing of an uncompressed image: mmap'ed,
+    # sections are slices of the file
+    from e32exe import (E32ImageHeader, E32RelocSection, load_image,
+                        readimports, getrelocs)
+    from util.binfile import BufferFile
+    image = corpus.build_e32(random.Random(0), scale << 17, scale << 13,
+                             compressed=False)
+    path = os.path.join(tempfile.mkdtemp(prefix='bench'), 'image.dll')
+    with open(path, 'wb') as fp:
+        fp.write(image)
+
+    def run():
+        with open(path, 'rb') as fp:
+            header = E32ImageHeader(fp)
+            view = memoryview(load_image(fp, header))
+        readimports(view, header)
+        inflated = BufferFile(view)
+        inflated.seek(header.iCodeRelocOffset)
+        getrelocs(E32RelocSection(inflated))
+    return len(image), run
+
+
+@benchmark
+def export_scan(scale):
+    # inflated only up to the export directory, see index-exports.py
+    from e32exe import E32ImageHeader, load_image, export_dir_end, getexports
+    image = corpus.build_e32(random.Random(0), scale << 15, scale << 11,
+                             exports=256)
+
+    def run():
+        fp = io.BytesIO(image)
+        header = E32ImageHeader(fp)
+        getexports(load_image(fp, header, export_dir_end(header)), header)
+    return E32ImageHeader(io.BytesIO(image)).iUncompressedSize, run
+
+
+@benchmark
+def import_scan(scale):
+    # inflated only up to the end of the import section, see import-graph.py
+    from e32exe import scan_imports
+    image = corpus.build_e32(random.Random(0), scale << 15, scale << 11,
+                             ('euser.dll', 'efsrv.dll'))
+    path = os.path.join(tempfile.mkdtemp(prefix='bench'), 'image.dll')
+    with open(path, 'wb') as fp:
+        fp.write(image)
+    return len(image), lambda: scan_imports(path)
+
+
+@benchmark
+def metadata_scan(scale):
+    # inventory record of a package with bulky files, see scan.py; the
+    # file data is never decompressed, so this runs far above extract_sis
+    from sisfile import SymbianFileHeader, scan_sis
+    rng = random.Random(0)
+    files = [(f'c:\\sys\\bin\\f{i}.dll', rng.randbytes(scale << 16))
+             for i in range(16)]
+    package = corpus.build_sis(files)
+
+    def run():
+        fp = io.BytesIO(package)
+        scan_sis(fp, SymbianFileHeader(fp))
+    return len(package), run
+
+
+def measure(name, scale, repeat):
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        size, run = BENCHMARKS[name](scale)
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - t)
+    seconds = min(times)
+    return {
+        'name': name,
+        'scale': scale,
+        'bytes': size,
+        'seconds': seconds,
+        'mb_per_s': size / seconds / 1e6,
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def importtime(module, *argv):
+    # cumulative import time of module, in microseconds, and all modules
+    # imported, when running argv (python -c 'import module' by default)
+    argv = argv or ('-c', f'import {module}')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', *argv],
+                          cwd=ROOT, capture_output=True, text=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', line)
+        if m:
+            times[m[3]] = int(m[1])
+    return times.get(module), set(times)
+
+
+def check_imports(budget_ms):
+    # main.py on a SIS package must not pay for the E32 side, the symbol
+    # database, the store or the subprocess machinery
+    failures = []
+    result = {'name': 'import_time', 'budget_ms': budget_ms}
+    with tempfile.TemporaryDirectory() as tmp:
+        package = os.path.join(tmp, 'package.sis')
+        with open(package, 'wb') as fp:
+            fp.write(corpus.build_sis([('c:\\a.txt', b'a')]))
+        _, modules = importtime('sisfile', 'main.py', '-p', package, tmp)
+    for forbidden in ('e32exe', 'util.e32db', 'subprocess', 'hashlib'):
+        if forbidden in modules:
+            failures.append(f"main.py -p on a SIS package imports {forbidden}")
+    for module in ('sisfile', 'e32exe'):
+        us = min(importtime(module)[0] for _ in range(3))
+        result[f'{module}_ms'] = us / 1000
+        if us > budget_ms * 1000:
+            failures.append(f"import {module} took {us / 1000:.1f} ms, "
+                            f"budget is {budget_ms} ms")
+    result['failures'] = failures
+    return result
+
+
+def _parse_any(data):
+    # canonical form of everything parsed from one input
+    from util import treecodec
+    fp = io.BytesIO(data)
+    if data[16:20] == b'EPOC':
+        from e32exe import E32ImageHeader, E32HuffmanStream
+        header = E32ImageHeader(fp)
+        h = E32HuffmanStream()
+        h.feed(data[header.iCodeOffset:])
+        out = bytearray(header.iUncompressedSize)
+        h.decode_into(out)
+        return treecodec.dumps(header) + out
+    from sisfile import SymbianFileHeader, SISField
+    SymbianFileHeader(fp)
+    contents = SISField(fp)
+    # index the lazy arrays from every thread as well; they are encoded
+    # as offsets, not items
+    out = bytearray(treecodec.dumps(contents))
+    for unit in contents.Data.DataUnits.Contents:
+        for fd in unit.FileData.Contents:
+            out += treecodec.dumps(fd)
+    return bytes(out)
+
+
+def _fresh_type(name):
+    from util.binfile import StructureMeta, BaseType
+    return StructureMeta.from_struct('H', name=name, bases=BaseType)
+
+
+def _payloads(contents):
+    return [fd.FileData.CompressedData
+            for fd in contents.Data.DataUnits.Contents[0].FileData.Contents]
+
+
+def check_threads(scale, threads=8, rounds=4):
+    # Parse a mixed corpus serially, then again from a thread pool, and
+    # compare: the engine must give identical results under concurrency.
+    # Also races first instantiations of the same template.
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from sisfile import SISArray, SISField, SymbianFileHeader
+    from util import treecodec
+    from util.binfile import Array, LazyArray
+    failures = []
+    rng = random.Random(0)
+    inputs = []
+    for i in range(2 * scale + 2):
+        files = [(f'c:\\f{j}.bin', corpus.payload(rng, 4096))
+                 for j in range(1 + i % 5)]
+        inputs.append(corpus.build_sis(files, deflate=bool(i % 2)))
+        inputs.append(corpus.build_e32(rng, 0x400 * (1 + i % 3), 0x100))
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        t = time.perf_counter()
+        expected = [_parse_any(data) for data in inputs]
+        serial = time.perf_counter() - t
+
+        barrier = threading.Barrier(threads)
+        # fresh template arguments, never instantiated before
+        fresh = [_fresh_type(f'Fresh{i}') for i in range(threads)]
+
+        def instantiate(_):
+            barrier.wait()
+            return [(SISArray[tp], Array[tp], LazyArray[tp]) for tp in fresh]
+        with ThreadPoolExecutor(threads) as pool:
+            made = list(pool.map(instantiate, range(threads)))
+            if any(m != made[0] for m in made):
+                failures.append("concurrent template instantiation "
+                                "produced different classes")
+            t = time.perf_counter()
+            results = list(pool.map(_parse_any, inputs * rounds))
+            parallel = (time.perf_counter() - t) / rounds
+
+            # one tree shared by all threads: lazy arrays seeking the same
+            # file, lazily decoded fields of the same codec buffer
+            package = corpus.build_sis([(f'c:\\f{j}.bin', bytes([j]) * 999)
+                                        for j in range(32)])
+            fp = io.BytesIO(package)
+            SymbianFileHeader(fp)
+            shared = SISField(fp)
+            want = _payloads(shared)
+            decoded = treecodec.loads(treecodec.dumps(shared), lazy=True,
+                                      fileobj=fp)
+            for name, tree in ('lazy arrays', shared), ('lazy decode', decoded):
+                got = list(pool.map(lambda _: _payloads(tree),
+                                    range(threads * rounds)))
+                if any(g != want for g in got):
+                    failures.append(f"{name} of a shared tree went wrong "
+                                    f"under concurrent access")
+    for i, result in enumerate(results):
+        if result != expected[i % len(inputs)]:
+            failures.append(f"input {i % len(inputs)} parsed differently "
+                            f"in a thread")
+            break
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    return {'name': 'threads', 'threads': threads, 'inputs': len(inputs),
+            'gil': gil, 'serial_s': serial, 'parallel_s': parallel,
+            'speedup': serial / parallel, 'failures': failures}
+
+
+def check_stream(scale):
+    # Non-seekable input through util.stream: seeking forward further than
+    # its window, as iter_file_data does past every payload it skips,
+    # must land on the right bytes.
+    from sisfile import SymbianFileHeader, iter_file_data, parse_controller
+    from util.binfile import ParseError
+    from util.stream import ForwardReader
+    failures = []
+    rng = random.Random(0)
+    data = rng.randbytes(1 << 20)
+    fp = ForwardReader(io.BytesIO(data))
+    for offset in 16, 300000, 500000, 499000, len(data) - 8:
+        fp.seek(offset)
+        if fp.read(16) != data[offset:offset + 16]:
+            failures.append(f"read after seeking to {offset} went wrong")
+    files = [(f'c:\\f{i}.bin', corpus.payload(rng, 200 << 10))
+             for i in range(3 * scale)]
+    package = corpus.build_sis(files, deflate=False)
+    fp = ForwardReader(io.BytesIO(package))
+    SymbianFileHeader(fp)
+    parse_controller(fp)
+    count = 0
+    try:
+        for entry in iter_file_data(fp):
+            # read only every other payload, the rest is skipped
+            if entry.index % 2:
+                fp.seek(entry.offset)
+                if fp.read(entry.length) != \
+                        package[entry.offset:entry.offset + entry.length]:
+                    failures.append(f"payload {entry.index} read wrong "
+                                    f"from a stream")
+            count += 1
+    except ParseError as e:
+        failures.append(f"a streamed package did not parse: {e}")
+    if count != len(files):
+        failures.append(f"{count} payloads found in a stream, "
+                        f"{len(files)} expected")
+    return {'name': 'stream', 'failures': failures}
+
+
+def check_limits(scale):
+    # Hostile inputs must be stopped by util.limits with a LimitExceeded,
+    # quickly, while ordinary ones parse the same with or without limits.
+    from sisfile import (SymbianFileHeader, extract_stream, iter_file_data,
+                         parse_contents, parse_controller, _payload_chunks)
+    from e32exe import E32ImageHeader, load_image
+    from util.binfile import LimitExceeded
+    from util.limits import Limits
+    failures = []
+    bomb = corpus.build_sis([('c:\\z.bin', bytes(scale << 26))])
+    image = corpus.build_e32(random.Random(0), scale << 20, 0x400)
+    normal = corpus.build_sis([(f'c:\\f{j}.bin',
+                                corpus.payload(random.Random(j), 4096))
+                               for j in range(4)])
+
+    def sis(data):
+        fp = io.BytesIO(data)
+        SymbianFileHeader(fp)
+        return fp
+
+    def contents(data):
+        # payloads included, SISData is only parsed when they are wanted
+        return _payloads(parse_contents(sis(data)))
+
+    def stream(data):
+        fp = sis(data)
+        parse_controller(fp)
+        for entry in list(iter_file_data(fp)):
+            for _ in _payload_chunks(fp, entry):
+                pass
+
+    def e32(data):
+        fp = io.BytesIO(data)
+        load_image(fp, E32ImageHeader(fp))
+
+    cases = [
+        ("zlib bomb, ratio", contents, bomb, dict(max_ratio=100)),
+        ("zlib bomb, streamed", stream, bomb, dict(max_ratio=100)),
+        ("declared payload size", contents, bomb, dict(max_output=1 << 20)),
+        ("nesting", contents, normal, dict(max_depth=4)),
+        ("wall time", contents, bomb, dict(max_seconds=0)),
+        ("E32 image size", e32, image, dict(max_output=1 << 16)),
+        ("E32 wall time", e32, image, dict(max_seconds=0.01)),
+    ]
+    timings = {}
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        for name, func, data, limits in cases:
+            t = time.perf_counter()
+            try:
+                with Limits(**limits):
+                    func(data)
+            except LimitExceeded:
+                pass
+            else:
+                failures.append(f"{name}: not stopped")
+            timings[name] = time.perf_counter() - t
+        loose = Limits(max_output=1 << 24, max_ratio=1000, max_depth=64,
+                       max_seconds=60)
+        with loose:
+            limited = contents(normal)
+        if limited != contents(normal):
+            failures.append("a package parsed differently within limits")
+
+        # limits are per thread: one finishing its file, with a loose
+        # budget, must not lift a tight one elsewhere
+        import threading
+        from util.limits import limits as active
+        entered = threading.Barrier(2)
+        left = threading.Event()
+        seen = {}
+
+        def loose_file():
+            with Limits(max_output=1 << 30):
+                entered.wait()
+            left.set()
+
+        def tight_file():
+            tight = Limits(max_output=1 << 20)
+            with tight:
+                entered.wait()
+                left.wait()
+                seen['tight'] = active() is tight
+                try:
+                    contents(bomb)
+                except LimitExceeded:
+                    seen['stopped'] = True
+        threads = [threading.Thread(target=loose_file),
+                   threading.Thread(target=tight_file)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        if not seen.get('tight') or not seen.get('stopped'):
+            failures.append("leaving limits in one thread changed them "
+                            "in another")
+        if active() is not None:
+            failures.append("limits still active after leaving them")
+    return {'name': 'limits', 'seconds': timings, 'failures': failures}
+
+
+def main():
+    par = argparse.ArgumentParser(description="Run the benchmarks")
+    par.add_argument('names', nargs='*', help="any of: "
+                     f"{', '.join(BENCHMARKS)}, import_time, threads, "
+                     "stream, limits")
+    par.add_argument('--scale', type=int, default=1,
+                     help="multiply input sizes by this")
+    par.add_argument('--repeat', type=int, default=3,
+                     help="best of this many runs")
+    par.add_argument('--import-budget-ms', type=float, default=60,
+                     help="fail if importing a format module takes longer")
+    par.add_argument('-o', '--output', help="write JSON here, not to stdout")
+    par.add_argument('--child', help=argparse.SUPPRESS)
+    arg = par.parse_args()
+
+    if arg.child:
+        json.dump(measure(arg.child, arg.scale, arg.repeat), sys.stdout)
+        return
+
+    checks = {
+        'import_time': lambda: check_imports(arg.import_budget_ms),
+        'threads': lambda: check_threads(arg.scale),
+        'stream': lambda: check_stream(arg.scale),
+        'limits': lambda: check_limits(arg.scale),
+    }
+    for name in arg.names:
+        if name not in BENCHMARKS and name not in checks:
+            par.error(f"unknown benchmark: {name}")
+    results = []
+    for name in arg.names or [*BENCHMARKS, *checks]:
+        if name in checks:
+            results.append(checks[name]())
+            continue
+        proc = subprocess.run(
+            [sys.executable, '-m', 'bench.run', '--child', name,
+             '--scale', str(arg.scale), '--repeat', str(arg.repeat)],
+            cwd=ROOT, stdout=subprocess.PIPE, check=True)
+        results.append(json.loads(proc.stdout))
+        print(f"{name}: {results[-1]['mb_per_s']:.3f} MB/s", file=sys.stderr)
+
+    report = {
+        'python': sys.version,
+        'platform': platform.platform(),
+        'time': time.time(),
+        'results': results,
+    }
+    if arg.output:
+        with open(arg.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    if any(r.get('failures') for r in results):
+        for r in results:
+            for failure in r.get('failures', ()):
+                print(failure, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import os
+from functools import partial
+from scan import find_files, inventory
+from util.batch import pmap
+from util.cache import filehash
+from util.catalog import Catalog
+from util.limits import add_arguments, from_args
+
+CATALOG = os.environ.get('SISCATALOG', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'catalog.sqlite'))
+
+
+def digest(path):
+    try:
+        with open(path, 'rb') as fp:
+            return filehash(fp)
+    except OSError:
+        return None
+
+
+def examine(path, limits=None):
+    try:
+        with open(path, 'rb') as fp:
+            return inventory(fp, imports=True, limits=limits)
+    except OSError as e:
+        return {'format': None, 'error': str(e)}
+
+
+def update(cat, arg):
+    # files whose size and mtime did not change are not even opened, and
+    # changed ones are only scanned if their contents are new
+    old = cat.files()
+    stats = {}
+    for fn in find_files(arg.path):
+        fn = os.path.abspath(fn)
+        try:
+            st = os.stat(fn)
+        except OSError:
+            continue
+        stats[fn] = st.st_size, st.st_mtime_ns
+    todo = [fn for fn, st in stats.items()
+            if tuple(old.get(fn, ())[:2]) != st]
+
+    scanned = 0
+    with cat.db:
+        for fn in old:
+            if fn not in stats and not os.path.exists(fn):
+                cat.remove_file(fn)
+        new = {}
+        for fn, sha in zip(todo, pmap(arg.jobs, digest, todo)):
+            if sha is None:
+                continue
+            cat.set_file(fn, *stats[fn], sha)
+            if not cat.known(sha):
+                new.setdefault(sha, fn)
+        records = pmap(arg.jobs, partial(examine, limits=from_args(arg)),
+                       list(new.values()))
+        for sha, rec in zip(new, records):
+            if 'error' in rec and arg.verbose:
+                print(f"skipped: {new[sha]}: {rec['error']}")
+            cat.add(sha, rec)
+            scanned += 1
+        cat.prune()
+    if arg.verbose:
+        print(f"{len(stats)} files, {len(todo)} changed, {scanned} scanned")
+
+
+def main():
+    par = argparse.ArgumentParser(description="""
+    Keep a catalog of SIS packages and E32 images, rescanning only what
+    changed, and answer questions about them from it. Example:
+    catalog.py ~/archive; catalog.py --installs '\\sys\\bin\\foo.dll'
+    """)
+    par.add_argument('path', nargs='*', help="files or directories of them")
+    par.add_argument('-d', '--db', default=CATALOG,
+                     help=f"catalog database (default: {CATALOG})")
+    par.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                     help="hash and scan changed files in this many processes")
+    par.add_argument('-v', '--verbose', action='store_true',
+                     help="report skipped files and what was rescanned")
+    add_arguments(par)
+    par.add_argument('--installs', metavar='TARGET', action='append',
+                     default=[], help="list packages installing TARGET, "
+                     "with or without a drive")
+    par.add_argument('--capability', metavar='CAP', action='append',
+                     default=[], help="list images with capability CAP")
+    par.add_argument('--imports', metavar='DLL[@ORD]', action='append',
+                     default=[], help="list images importing from DLL")
+    par.add_argument('--uid', type=lambda s: int(s, 0), action='append',
+                     default=[], help="list packages and images of this UID")
+    par.add_argument('--show', metavar='PATH', action='append', default=[],
+                     help="print the catalogued record of PATH")
+
+    arg = par.parse_args()
+    with Catalog(arg.db) as cat:
+        if arg.path:
+            update(cat, arg)
+        for target in arg.installs:
+            for path, installed in cat.installing(target):
+                print(f"{path}: {installed}")
+        found = []
+        for cap in arg.capability:
+            found += cat.with_capability(cap)
+        for spec in arg.imports:
+            dll, _, ordinal = spec.partition('@')
+            found += cat.importing(dll, int(ordinal, 0) if ordinal else None)
+        for uid in arg.uid:
+            found += cat.by_uid(uid)
+        for path in found:
+            print(path)
+        for path in arg.show:
+            print(cat.record(os.path.abspath(path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 
-import array
-import io
 import os.path
 import struct
+import sys
 import time
 from enum import IntEnum
-from subprocess import check_call, Popen, PIPE
-from e32def import deffiles
+from functools import lru_cache
 
 from util.binfile import (
     Structure,
@@ -27,8 +25,21 @@ from util.binfile import (
     CountIn,
     LengthIn,
     StructureTotalLength,
+    BufferFile,
+    ParseError,
+    debug,
 )
 from util.bitstream import Decompressor
+from util.crc import crc16
+from util.e32db import E32Def
+from util.limits import limits, STEP as LIMITS_STEP
+from util.output import get_output
+from util.profile import stage
+from util.progress import progress, STEP as PROGRESS_STEP
+
+# symbol database written by gen-e32def.py
+E32DEF = os.environ.get('E32DEF', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'e32def.db'))
 
 TInt = Int32
 TInt16 = Int16
@@ -37,42 +48,6 @@ TUint32 = TUint = UInt32
 TUint16 = UInt16
 TUint8 = UInt8
 
-crc16tab = array.array('H', [
-    # kernel/eka/euser/us_func.cpp:53
-    0x0000,0x1021,0x2042,0x3063,0x4084,0x50a5,0x60c6,0x70e7,0x8108,0x9129,0xa14a,
-    0xb16b,0xc18c,0xd1ad,0xe1ce,0xf1ef,0x1231,0x0210,0x3273,0x2252,0x52b5,0x4294,
-    0x72f7,0x62d6,0x9339,0x8318,0xb37b,0xa35a,0xd3bd,0xc39c,0xf3ff,0xe3de,0x2462,
-    0x3443,0x0420,0x1401,0x64e6,0x74c7,0x44a4,0x5485,0xa56a,0xb54b,0x8528,0x9509,
-    0xe5ee,0xf5cf,0xc5ac,0xd58d,0x3653,0x2672,0x1611,0x0630,0x76d7,0x66f6,0x5695,
-    0x46b4,0xb75b,0xa77a,0x9719,0x8738,0xf7df,0xe7fe,0xd79d,0xc7bc,0x48c4,0x58e5,
-    0x6886,0x78a7,0x0840,0x1861,0x2802,0x3823,0xc9cc,0xd9ed,0xe98e,0xf9af,0x8948,
-    0x9969,0xa90a,0xb92b,0x5af5,0x4ad4,0x7ab7,0x6a96,0x1a71,0x0a50,0x3a33,0x2a12,
-    0xdbfd,0xcbdc,0xfbbf,0xeb9e,0x9b79,0x8b58,0xbb3b,0xab1a,0x6ca6,0x7c87,0x4ce4,
-    0x5cc5,0x2c22,0x3c03,0x0c60,0x1c41,0xedae,0xfd8f,0xcdec,0xddcd,0xad2a,0xbd0b,
-    0x8d68,0x9d49,0x7e97,0x6eb6,0x5ed5,0x4ef4,0x3e13,0x2e32,0x1e51,0x0e70,0xff9f,
-    0xefbe,0xdfdd,0xcffc,0xbf1b,0xaf3a,0x9f59,0x8f78,0x9188,0x81a9,0xb1ca,0xa1eb,
-    0xd10c,0xc12d,0xf14e,0xe16f,0x1080,0x00a1,0x30c2,0x20e3,0x5004,0x4025,0x7046,
-    0x6067,0x83b9,0x9398,0xa3fb,0xb3da,0xc33d,0xd31c,0xe37f,0xf35e,0x02b1,0x1290,
-    0x22f3,0x32d2,0x4235,0x5214,0x6277,0x7256,0xb5ea,0xa5cb,0x95a8,0x8589,0xf56e,
-    0xe54f,0xd52c,0xc50d,0x34e2,0x24c3,0x14a0,0x0481,0x7466,0x6447,0x5424,0x4405,
-    0xa7db,0xb7fa,0x8799,0x97b8,0xe75f,0xf77e,0xc71d,0xd73c,0x26d3,0x36f2,0x0691,
-    0x16b0,0x6657,0x7676,0x4615,0x5634,0xd94c,0xc96d,0xf90e,0xe92f,0x99c8,0x89e9,
-    0xb98a,0xa9ab,0x5844,0x4865,0x7806,0x6827,0x18c0,0x08e1,0x3882,0x28a3,0xcb7d,
-    0xdb5c,0xeb3f,0xfb1e,0x8bf9,0x9bd8,0xabbb,0xbb9a,0x4a75,0x5a54,0x6a37,0x7a16,
-    0x0af1,0x1ad0,0x2ab3,0x3a92,0xfd2e,0xed0f,0xdd6c,0xcd4d,0xbdaa,0xad8b,0x9de8,
-    0x8dc9,0x7c26,0x6c07,0x5c64,0x4c45,0x3ca2,0x2c83,0x1ce0,0x0cc1,0xef1f,0xff3e,
-    0xcf5d,0xdf7c,0xaf9b,0xbfba,0x8fd9,0x9ff8,0x6e17,0x7e36,0x4e55,0x5e74,0x2e93,
-    0x3eb2,0x0ed1,0x1ef0
-])
-
-
-def crc16(bts):
-    crc = 0
-    for b in bts:
-        crc = (crc << 8 ^ crc16tab[b ^ crc >> 8 & 0xff]) & 0xffff
-    return crc
-
-
 def uidcrc(u1, u2, u3):
     b = u1._tobytes() + u2._tobytes() + u3._tobytes()
     return crc16(b[1::2]) << 16 | crc16(b[::2])
@@ -95,6 +70,20 @@ class timeint(int):
 
     def __repr__(self):
         return time.ctime(self / 1e6 + time.mktime((0,)*9))
+
+    def isoformat(self):
+        # microseconds since 0 AD, which datetime starts a (leap) year
+        # after; None for times datetime cannot hold: that year (unset
+        # ones included) and past 9999
+        from datetime import datetime, timedelta
+        us = self - 366 * 86400 * 10**6
+        if us < 0:
+            return None
+        try:
+            return (datetime(1, 1, 1)
+                    + timedelta(microseconds=us)).isoformat()
+        except OverflowError:
+            return None
 Millis64Since2000 = StructureMeta.from_struct('Q', name='Millis64Since2000',
                                               bases=get_base_type(timeint))
 
@@ -139,10 +128,32 @@ class TCompression(HexintEnum):
     KUidCompressionBytePair = 0x102822AA
 
 
+# iExportDescType: how holes in the export table are described
+KImageHdr_ExpD_NoHoles = 0x00
+KImageHdr_ExpD_FullBitmap = 0x01  # one bit per export, set if present
+KImageHdr_ExpD_SparseBitmap8 = 0x02  # bitmap of the non-0xff bitmap bytes
+KImageHdr_ExpD_Xip = 0xff
+
+
+# TCapability, by bit number in SCapabilitySet
+CAPABILITIES = (
+    'TCB', 'CommDD', 'PowerMgmt', 'MultimediaDD', 'ReadDeviceData',
+    'WriteDeviceData', 'DRM', 'TrustedUI', 'ProtServ', 'DiskAdmin',
+    'NetworkControl', 'AllFiles', 'SwEvent', 'NetworkServices',
+    'LocalServices', 'ReadUserData', 'WriteUserData', 'Location',
+    'SurroundingsDD', 'UserEnvironment',
+)
+
+
 class SCapabilitySet(Structure):
     iCaps1 : TUint32
     iCaps2 : TUint32
 
+    def names(self):
+        caps = self.iCaps2 << 32 | self.iCaps1
+        return [CAPABILITIES[i] if i < len(CAPABILITIES) else f'cap{i}'
+                for i in range(64) if caps >> i & 1]
+
 
 class SSecurityInfo(Structure):
     iSecureId : TUint32
@@ -202,6 +213,7 @@ class E32ImageHeader(Structure):
 
 
 class E32ImportBlock(Structure):
+    __slots__ = 'dllName',  # set by readimports
     iOffsetOfDllName: TUint32		# Offset from start of import section for a NUL terminated executable (DLL or EXE) name.
     iNumberOfImports: TInt		# Number of imports from this executable.
     iImport: Array[TUint]		# For ELF-derived executes: list of code section offsets. For PE, list of imported ordinals. Omitted in PE2 import format
@@ -209,6 +221,7 @@ class E32ImportBlock(Structure):
 
 
 class E32ImportSection(Structure):
+    __slots__ = 'refTableCount',
     iSize: TInt		# Size of this section excluding 'this' structure
     # iSize: StructurePayloadLength  # actually this counts garbage as well
     iImportBlock: Array[E32ImportBlock]
@@ -277,7 +290,7 @@ def HuffmanL(L, idx=0, s=1):
     return d
 
 
-HuffmanDecoding = HuffmanL([
+HuffmanTable = [
     # kernel/eka/euser/us_decode.cpp:119
     0x0004006c,
     0x00040064,
@@ -307,7 +320,13 @@ HuffmanDecoding = HuffmanL([
     0x000b0009,
     0x00070003,
     0x00050001
-])
+]
+
+
+@lru_cache(None)
+def huffman_decoding():
+    # built on first decompression, not at import time
+    return HuffmanL(HuffmanTable)
 
 
 def bitstring_print(mapping):
@@ -349,7 +368,7 @@ class E32HuffmanStream(Decompressor):  # made up name
     def InternalizeL(self):
         last = 0
         while len(self._iEncoding) < self.KDeflationCodes:
-            c = self.nextunit(HuffmanDecoding)
+            c = self.nextunit(huffman_decoding())
             if self._iEncoding:
                 last = self._iEncoding[-1]
             if c < 2:
@@ -371,13 +390,14 @@ class E32HuffmanStream(Decompressor):  # made up name
             self._decoding = self._lldecoding
 
         code = max(self._ddecoding.values()) - self.KDeflateDistCodeBase
-        # xtra bits
-        xtra = (code >> 2) - 1
-        code -= xtra << 2
-        code <<= xtra
-        code |= (1 << xtra) - 1
+        if code >= 8:
+            # xtra bits
+            xtra = (code >> 2) - 1
+            code -= xtra << 2
+            code <<= xtra
+            code |= (1 << xtra) - 1
         self._maxd = code + 1
-        print(f"{self._maxd=}")
+        debug("maximum distance %d", self._maxd)
 
     def HuffmanDecoding(self, arr, base=0):
         levels = [[] for _ in range(27)]  # 27 == KMaxCodeLength
@@ -425,7 +445,7 @@ class E32HuffmanStream(Decompressor):  # made up name
             if val < self.ELiterals:
                 yield from self.remember([val])
             elif val == self.EEos:
-                print(f"EOS! {len(self._bits):#x} left")
+                debug("EOS, %#x bytes left", len(self._bits))
                 return
             else:
                 code = val & 0xff
@@ -448,6 +468,90 @@ class E32HuffmanStream(Decompressor):  # made up name
     def __iter__(self):
         return self.iterbytes()
 
+    def _checkpoint(self, prog, guard, fed, produced):
+        if prog is not None:
+            prog.update(fed - len(self._bits), produced)
+        if guard is not None:
+            guard.clock('E32 image')
+
+    def decode_into(self, out, pos=0, stop=None):
+        # like iterbytes, but straight into the preallocated out[pos:];
+        # back references are copied from out itself, so no window is
+        # kept. With stop, decoding ends as soon as out[:stop] is filled
+        # (out need not be any longer). Returns the end position.
+        self.InternalizeL()
+        end = len(out)
+        # never reached without stop: pos cannot get past end
+        last = end + 1 if stop is None else stop
+        fed = len(self._bits)
+        begin = pos
+        prog = progress('huffman', fed)
+        guard = limits()
+        # progress is reported and the clock checked whenever pos gets to
+        # limit, which is last unless someone is watching
+        step = PROGRESS_STEP if guard is None else LIMITS_STEP
+        watched = prog is not None or guard is not None
+        limit = min(last, pos + step) if watched else last
+        try:
+            for val in self.iterunits():
+                if val < self.ELiterals:
+                    if pos >= end:
+                        raise ValueError("inflated data overruns the image")
+                    out[pos] = val
+                    pos += 1
+                    if pos == limit:
+                        if pos == last:
+                            return pos
+                        self._checkpoint(prog, guard, fed, pos - begin)
+                        limit = min(last, pos + step)
+                elif val == self.EEos:
+                    debug("EOS, %#x bytes left", len(self._bits))
+                    return pos
+                else:
+                    code = val & 0xff
+                    if code >= 8:
+                        # xtra bits
+                        xtra = (code >> 2) - 1
+                        code -= xtra << 2
+                        code <<= xtra
+                        code |= self.nextbits(xtra)
+
+                    # length comes first, then the distance
+                    if val < self.KDeflateDistCodeBase:
+                        self._rptlength = code + self.KDeflateMinLength
+                        self._decoding = self._ddecoding
+                    else:
+                        d = code + 1
+                        le = self._rptlength
+                        if d > pos:
+                            raise ValueError(
+                                f"distance {d} before start of data")
+                        if pos + le > end:
+                            if stop is None:
+                                raise ValueError("inflated data overruns "
+                                                 "the image")
+                            le = end - pos
+                        src = pos - d
+                        if d >= le:
+                            out[pos:pos + le] = out[src:src + le]
+                        else:
+                            # overlapping: the last d bytes, repeated
+                            out[pos:pos + le] = \
+                                (out[src:pos] * (le // d + 1))[:le]
+                        pos += le
+                        self._decoding = self._lldecoding
+                        if pos >= limit:
+                            if pos >= last:
+                                return pos
+                            self._checkpoint(prog, guard, fed, pos - begin)
+                            limit = min(last, pos + step)
+            return pos
+        finally:
+            if prog is not None:
+                prog.consumed = fed - len(self._bits)
+                prog.produced = pos - begin
+                prog.done()
+
 
 def assembly(section, binary, relocs):
     yield from f'''
@@ -458,7 +562,7 @@ def assembly(section, binary, relocs):
 
     for i in range(0, len(binary), 4):
         reloc = relocs.get(i, hex)
-        word, = struct.unpack('<i', binary[i:i + 4])
+        word, = struct.unpack_from('<i', binary, i)
         yield f'''\t.4byte {reloc(word)}'''
 
 
@@ -490,74 +594,281 @@ def mangle(name):
     return ''.join(s)
 
 
+@lru_cache(None)
+def get_deffiles():
+    try:
+        return E32Def(E32DEF)
+    except FileNotFoundError:
+        print(f"{E32DEF} not found, run gen-e32def.py; no import names",
+              file=sys.stderr)
+        return {}
+
+
+# special case: obex.dll definitions are in irobex.def
+namemap = {
+    'obex': 'irobex',
+}
+
+
+@lru_cache(None)
+def resolve_dll(basename):
+    deffiles = get_deffiles()
+    if basename in deffiles:
+        return basename
+    if basename + 'u' in deffiles:
+        return basename + 'u'
+    if not deffiles:
+        return None
+    return deffiles.first_prefixed(namemap.get(basename, basename))
+
+
+@lru_cache(None)
+def lookup_symbol(lib, idx):
+    # shared by every image parsed in this process
+    try:
+        return get_deffiles()[lib][idx]
+    except IndexError:
+        return None
+
+
+def dllbasename(dllName):
+    # 'EUser{000a0000}.dll' -> 'euser', as the symbol database names them
+    return dllName.split('.')[0].split('{')[0].split('[')[0].lower()
+
+
+def readimports(view, header):
+    # E32ImportSection of a loaded image, DLL names filled in
+    inflated = BufferFile(view)
+    inflated.seek(header.iImportOffset)
+    imports = E32ImportSection(inflated,
+                               refTableCount=header.iDllRefTableCount)
+    for imp in imports.iImportBlock:
+        at = header.iImportOffset + imp.iOffsetOfDllName
+        dllName = view[at:at + 0x51]  # 0x50 == KMaxKernelName
+        imp.dllName = bytes(dllName).split(b'\0')[0].decode('ascii')
+    return imports
+
+
+def import_section_end(header):
+    # not in the header: the import section runs up to the next section,
+    # relocations follow it in images laid out by elf2e32
+    return min((off for off in (header.iCodeRelocOffset,
+                                header.iDataRelocOffset)
+                if off > header.iImportOffset),
+               default=header.iCodeOffset + header.iUncompressedSize)
+
+
+def scan_imports(path):
+    # (iUid3, {DLL name: sorted ordinals}) of the E32 image at path
+    with open(path, 'rb') as fp:
+        header = E32ImageHeader(fp)
+        return header.iUid3, image_imports(fp, header)
+
+
+def image_imports(fp, header):
+    # {DLL name: sorted ordinals}, inflated only as far as the end of the
+    # import section
+    if not header.iDllRefTableCount:
+        return {}
+    view = memoryview(load_image(fp, header, import_section_end(header)))
+    deps = {}
+    for imp in readimports(view, header).iImportBlock:
+        ordinals = deps.setdefault(imp.dllName, set())
+        for off in imp.iImport:
+            # the import word: addend << 12 | ordinal
+            val, = struct.unpack_from('<I', view, header.iCodeOffset + off)
+            ordinals.add(val & 0xfff)
+    return {name: sorted(ordinals) for name, ordinals in deps.items()}
+
+
 def getimports(imps):
-    def importer(key, fallback):
+    def importer(lib, fallback):
         def reloc(val):
             addend, idx = divmod(val, 0x1000)
-            try:
-                return f'{deffiles[key][idx]} + {addend}'
-            except IndexError:
+            sym = lookup_symbol(lib, idx)
+            if sym is None:
                 return fallback(val)
+            return f'{sym} + {addend}'
         return reloc
-    # special case: obex.dll definitions are in irobex.def
-    namemap = {
-        'obex': 'irobex',
-    }
 
     imports = {}
     for imp in imps.iImportBlock:
-        print(f"{len(imp.iImport)} imports from DLL: {imp.dllName!r}")
-        basename = imp.dllName.split('.')[0].split('{')[0].lower()
+        debug("%d imports from DLL: %r", len(imp.iImport), imp.dllName)
+        basename = dllbasename(imp.dllName)
         fallback = f'%s + {mangle(imp.dllName)}'.__mod__
-        if basename in deffiles:
-            thing = importer(basename, fallback)
-        elif basename + 'u' in deffiles:
-            thing = importer(basename + 'u', fallback)
+        lib = resolve_dll(basename)
+        if lib is None:
+            print(f"DLL {imp.dllName} not found at all!", file=sys.stderr)
+            thing = fallback
         else:
-            basename = namemap.get(basename, basename)
-            for lib in deffiles:
-                if lib.startswith(basename):
-                    thing = importer(lib, fallback)
-                    break
-            else:
-                print(f"DLL {imp.dllName} not found at all!")
-                thing = fallback
+            thing = importer(lib, fallback)
         for i in imp.iImport:
             imports[i] = thing
     return imports
 
 
-def objcopy(fp, header, target_dir):
+def _tversion(v):
+    return [v.iMajor, v.iMinor, v.iBuild]
+
+
+def scan_e32(fp, header):
+    # inventory record of an image, made of plain types for JSON: the
+    # header only, nothing is decompressed
+    def enum(val):
+        return getattr(val, 'name', None) or int(val)
+    return {
+        'uids': [header.iUid1, header.iUid2, header.iUid3],
+        'secure_id': header.iS.iSecureId,
+        'vendor_id': header.iS.iVendorId,
+        'capabilities': header.iS.iCaps.names(),
+        'module_version': [header.iModuleVersion >> 16,
+                           header.iModuleVersion & 0xffff],
+        'tools_version': _tversion(header.iToolsVersion),
+        'created': header.iTime.isoformat(),
+        'flags': header.iFlags,
+        'cpu': enum(header.iCpuIdentifier),
+        'compression': enum(header.iCompressionType),
+        'code_size': header.iCodeSize,
+        'data_size': header.iDataSize,
+        'bss_size': header.iBssSize,
+        'uncompressed_size': header.iUncompressedSize,
+        'heap': [header.iHeapSizeMin, header.iHeapSizeMax],
+        'stack_size': header.iStackSize,
+        'priority': header.iProcessPriority,
+        'dlls': header.iDllRefTableCount,
+        'exports': header.iExportDirCount,
+    }
+
+
+def exported_ordinals(header):
+    # ordinals present in the export directory, holes left out
+    count = header.iExportDirCount
+    desc = bytes(header.iExportDesc)
+    if header.iExportDescType == KImageHdr_ExpD_FullBitmap:
+        bitmap = desc
+    elif header.iExportDescType == KImageHdr_ExpD_SparseBitmap8:
+        nbytes = (count + 7) // 8
+        meta = desc[:(nbytes + 7) // 8]
+        listed = desc[len(meta):]
+        bitmap = bytearray(b'\xff' * nbytes)
+        present = [i for i in range(nbytes) if meta[i >> 3] >> (i & 7) & 1]
+        if len(listed) < len(present):
+            raise IndexError("export bitmap truncated")
+        for i, byte in zip(present, listed):
+            bitmap[i] = byte
+    else:
+        return range(1, count + 1)
+    return [i + 1 for i in range(count) if bitmap[i >> 3] >> (i & 7) & 1]
+
+
+def export_dir_end(header):
+    return header.iExportDirOffset + 4 * header.iExportDirCount
+
+
+def map_image(fp):
+    # all of fp as a read-only buffer without copying it: mmap'ed if fp is
+    # a file, its own buffer if it has one (BytesIO, BufferFile)
+    try:
+        import mmap
+        return memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+    except (AttributeError, OSError, ValueError):
+        # not a file, a pipe, or an empty one
+        pass
+    if hasattr(fp, 'getbuffer'):
+        return fp.getbuffer()
+    fp.seek(0)
+    return memoryview(fp.read())
+
+
+def load_image(fp, header, stop=None):
+    # The whole image in one buffer: header, then inflated straight after
+    # it. With stop, only the first stop bytes of it, inflating no further.
+    if header.iCompressionType == TCompression.KFormatNotCompressed:
+        # the file is the image already, sections are slices of it
+        view = map_image(fp)
+        need = stop
+        if need is None:
+            # every section is read from it, not only the code
+            need = max(header.iCodeOffset + header.iCodeSize,
+                       header.iDataOffset + header.iDataSize,
+                       header.iImportOffset, header.iCodeRelocOffset,
+                       header.iDataRelocOffset)
+        if len(view) < need:
+            raise ParseError(f"image is {len(view):#x} bytes, "
+                             f"header says at least {need:#x}")
+        return view if stop is None else view[:stop]
     if header.iCompressionType != TCompression.KUidCompressionDeflate:
-        raise NotImplementedError("Only KUidCompressionDeflate supported")
+        raise NotImplementedError("Only KUidCompressionDeflate and "
+                                  "KFormatNotCompressed supported")
+    size = header.iCodeOffset + header.iUncompressedSize
+    if stop is not None:
+        size = min(size, stop)
+    guard = limits()
+    if guard is not None:
+        guard.declared(size, 'E32 image')
+    image = bytearray(size)
     fp.seek(0)
-    headerbytes = fp.read(header.iCodeOffset)
+    fp.readinto(memoryview(image)[:header.iCodeOffset])
+    if size <= header.iCodeOffset:
+        return image
+
+    with stage('huffman') as st:
+        h = E32HuffmanStream()
+        compressed = fp.read()
+        if guard is not None:
+            guard.produced(size, len(compressed), 'E32 image')
+        h.feed(compressed)
+        end = h.decode_into(image, header.iCodeOffset,
+                            None if stop is None else size)
+        st.bytes_in = len(compressed)
+        st.bytes_out = end - header.iCodeOffset
+    if end != size:
+        raise ValueError(f"inflated {end - header.iCodeOffset:#x} bytes, "
+                         f"header says {size - header.iCodeOffset:#x}")
+    return image
+
+
+def getexports(image, header):
+    # (ordinal, code offset) of every export; image from load_image, up
+    # to export_dir_end at least
+    addrs = struct.unpack_from(f'<{int(header.iExportDirCount)}I', image,
+                               header.iExportDirOffset)
+    # 32-bit address arithmetic: a stray address still gives an int32
+    return [(i, (addrs[i - 1] - header.iCodeBase + 0x80000000) % (1 << 32)
+             - 0x80000000)
+            for i in exported_ordinals(header)]
+
+
+def scan_exports(path):
+    # (iUid3, exports) of the E32 image at path, inflated only as far as
+    # the end of its export directory
+    with open(path, 'rb') as fp:
+        header = E32ImageHeader(fp)
+        image = load_image(fp, header, export_dir_end(header))
+    return header.iUid3, getexports(image, header)
 
-    h = E32HuffmanStream()
-    h.feed(fp.read())
-    inflated = io.BytesIO()
-    inflated.write(headerbytes)
-    inflated.write(bytes(h))
 
-    inflated.seek(0)
-    with open(os.path.join(target_dir, 'uncompressed.exe'), 'wb') as dump:
-        dump.write(inflated.read())
+def objcopy(fp, header, target_dir):
+    output = get_output(target_dir)
+    target_dir = output.target_dir
+    if target_dir is None:
+        # an archive: the assembler and linker still want files
+        import tempfile
+        workdir = tempfile.TemporaryDirectory(prefix='objcopy')
+        target_dir = workdir.name
+    # sections are views into the image, never copies
+    view = memoryview(load_image(fp, header))
 
-    inflated.seek(header.iCodeOffset)
-    code = inflated.read(header.iCodeSize)
+    with stage('write', len(view)):
+        output.add('uncompressed.exe', view)
 
-    # remaining data follows
-    inflated.seek(header.iDataOffset)
-    data = inflated.read(header.iDataSize)
+    code = view[header.iCodeOffset:header.iCodeOffset + header.iCodeSize]
 
-    inflated.seek(header.iImportOffset)
-    imports = E32ImportSection(inflated,
-                               refTableCount=header.iDllRefTableCount)
+    # remaining data follows
+    data = view[header.iDataOffset:header.iDataOffset + header.iDataSize]
 
-    for imp in imports.iImportBlock:
-        inflated.seek(header.iImportOffset + imp.iOffsetOfDllName)
-        dllName = inflated.read(0x51)  # 0x50 == KMaxKernelName
-        imp.dllName = dllName.split(b'\0')[0].decode('ascii')
+    with stage('parse'):
+        imports = readimports(view, header)
 
     lines = f'''
 \t.arch {header.iCpuIdentifier.toAsMachine()}
@@ -570,30 +881,43 @@ def objcopy(fp, header, target_dir):
 \tdatamv = datastart - {header.iDataBase:#x}
 '''.splitlines()
 
-    inflated.seek(header.iCodeRelocOffset)
-    coderel = getrelocs(E32RelocSection(inflated))
-    coderel.update(getimports(imports))
-    lines.extend(assembly('text', code, coderel))
+    with stage('relocs'):
+        inflated = BufferFile(view)
+        inflated.seek(header.iCodeRelocOffset)
+        coderel = getrelocs(E32RelocSection(inflated))
+        coderel.update(getimports(imports))
+        inflated.seek(header.iDataRelocOffset)
+        if header.iDataSize:
+            datarel = getrelocs(E32RelocSection(inflated))
+        else:
+            datarel = {}
 
-    inflated.seek(header.iDataRelocOffset)
-    if header.iDataSize:
-        datarel = getrelocs(E32RelocSection(inflated))
-    else:
-        datarel = {}
-    lines.extend(assembly('data', data, datarel))
+    with stage('assembly', len(code) + len(data)) as st:
+        lines.extend(assembly('text', code, coderel))
+        lines.extend(assembly('data', data, datarel))
+        lines.append('')
+        source = '\n'.join(lines)
+        st.bytes_out = len(source)
 
-    lines.append('')
+    # only needed for building the ELF, slow to import
+    from subprocess import check_call, Popen, PIPE
     relo = os.path.join(target_dir, 'rel.o')
-    Popen(['arm-none-eabi-as', '-o', relo], stdin=PIPE,
-          universal_newlines=True).communicate('\n'.join(lines))
-    check_call(['arm-none-eabi-ld',
-           '-o', os.path.join(target_dir, 'obj.elf'),
-           relo,
-           f'--entry=_E32Startup',
-           f'-shared',
-           f'-z', f'max-page-size=0x1000',
-           f'-z', f'separate-code',
-           f'--section-start=.text={header.iCodeBase:#x}',
-           f'--section-start=.data={header.iDataBase:#x}',
-           f'--section-start=.gnu.hash={header.iDataBase-0x10000:#x}',
-    ])
+    with stage('as', len(source)):
+        Popen(['arm-none-eabi-as', '-o', relo], stdin=PIPE,
+              universal_newlines=True).communicate(source)
+    with stage('ld'):
+        check_call(['arm-none-eabi-ld',
+               '-o', os.path.join(target_dir, 'obj.elf'),
+               relo,
+               f'--entry=_E32Startup',
+               f'-shared',
+               f'-z', f'max-page-size=0x1000',
+               f'-z', f'separate-code',
+               f'--section-start=.text={header.iCodeBase:#x}',
+               f'--section-start=.data={header.iDataBase:#x}',
+               f'--section-start=.gnu.hash={header.iDataBase-0x10000:#x}',
+        ])
+    if output.target_dir is None:
+        with open(os.path.join(target_dir, 'obj.elf'), 'rb') as elf:
+            output.add('obj.elf', elf.read())
+        workdir.cleanup()
@@ -1,41 +1,81 @@
 
 import argparse
-import json
+import hashlib
+import os
 from os.path import basename
-from e32exe import mangle
+from e32exe import mangle, E32DEF
+from util.batch import load_pickle, pmap, save_pickle
+from util.e32db import parse_def, write_e32def
+from util.output import atomic_write
 
-par = argparse.ArgumentParser(description="""
-Example usage:
-gen-e32def.py [--clean] $(find ~/symbian -name '*.def'|grep -v test|grep -i /eabi/)
-""")
-par.add_argument('infile', nargs='+')
-par.add_argument('--clean', action='store_true', help="throw away current def")
+MANIFEST_VERSION = 1
 
-arg = par.parse_args()
 
-if arg.clean:
+def filehash(fn):
+    with open(fn, 'rb') as fp:
+        return hashlib.file_digest(fp, 'sha256').hexdigest()
+
+
+def load_manifest(path):
+    # abspath -> (size, mtime_ns, sha256, dllname, symbol list)
+    return load_pickle(path, MANIFEST_VERSION, {})
+
+
+def main():
+    par = argparse.ArgumentParser(description="""
+    Example usage:
+    gen-e32def.py [--clean] $(find ~/symbian -name '*.def'|grep -v test|grep -i /eabi/)
+    """)
+    par.add_argument('infile', nargs='+')
+    par.add_argument('--clean', action='store_true',
+                     help="throw away current def")
+    par.add_argument('-o', '--output', default=E32DEF,
+                     help=f"symbol database to write (default: {E32DEF})")
+    par.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                     help="parse changed .def files in this many processes")
+
+    arg = par.parse_args()
+    manifest_path = arg.output + '.manifest'
+    old = {} if arg.clean else load_manifest(manifest_path)
+
+    # entries for files not given this time stay, the ones given are moved
+    # to the end so that, like before, the last file of a DLL name wins
+    manifest = {}
+    infiles = {os.path.abspath(fn): None for fn in arg.infile}
+    todo = []
+    for fn in old:
+        if fn not in infiles:
+            manifest[fn] = old[fn]
+    for fn in infiles:
+        st = os.stat(fn)
+        entry = old.get(fn)
+        if entry and entry[:2] == (st.st_size, st.st_mtime_ns):
+            manifest[fn] = entry
+            continue
+        digest = filehash(fn)
+        if entry and entry[2] == digest:
+            manifest[fn] = (st.st_size, st.st_mtime_ns) + entry[2:]
+            continue
+        manifest[fn] = st.st_size, st.st_mtime_ns, digest
+        todo.append(fn)
+
+    if not todo and manifest == old and os.path.exists(arg.output):
+        return
+
+    for fn, d in zip(todo, pmap(arg.jobs, parse_def, todo)):
+        dllname = basename(fn).split('.')[0].lower()
+        if not d:
+            print(f"empty: {fn}")
+        manifest[fn] += dllname, [d.get(i, f'_{mangle(dllname)}_missing_{i}')
+                                  for i in range(max(d, default=0) + 1)]
+
     deffiles = {}
-else:
-    try:
-        from e32def import deffiles
-    except ImportError:
-        deffiles = {}
-
-for fn in arg.infile:
-    d = {}
-    dllname = basename(fn).split('.')[0].lower()
-    with open(fn) as f:
-        for line in f:
-            fields = line.strip().split('@')
-            if len(fields) >= 2:
-                sym, num = fields
-                num = num.split()[0]
-                d[int(num)] = sym.strip()
-    if not d:
-        print(f"empty: {fn}")
-    deffiles[dllname] = [d.get(i, f'_{mangle(dllname)}_missing_{i}')
-                         for i in range(max(d, default=0) + 1)]
-
-with open('e32def.py', 'w') as fp:
-    fp.write('deffiles = ')
-    json.dump(deffiles, fp, indent=4)
+    for entry in manifest.values():
+        deffiles[entry[3]] = entry[4]
+
+    atomic_write(arg.output, lambda fp: write_e32def(fp, deffiles))
+    save_pickle(manifest_path, MANIFEST_VERSION, manifest)
+
+
+if __name__ == '__main__':
+    main()
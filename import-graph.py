@@ -0,0 +1,171 @@
+import argparse
+import os
+from functools import partial
+from os.path import basename
+from e32exe import scan_imports, dllbasename
+from util.batch import find_images, guarded, load_pickle, pmap, save_pickle
+from util.cache import filehash
+
+CACHE_VERSION = 2
+IMPORTCACHE = os.environ.get('E32IMPORTS', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'e32imports.cache'))
+
+
+def digest(path):
+    with open(path, 'rb') as fp:
+        return filehash(fp)
+
+
+def load_cache(path):
+    # abspath -> (size, mtime_ns, sha256), and
+    # sha256 -> (iUid3, {DLL name: ordinals})
+    return load_pickle(path, CACHE_VERSION, ({}, {}))
+
+
+def summarise(arg):
+    # summaries of every image found, scanning only the new ones
+    oldfiles, oldsummaries = load_cache(arg.cache)
+    files = {}
+    todo = []
+    for fn in find_images(arg.path):
+        st = os.stat(fn)
+        entry = oldfiles.get(fn)
+        if entry and entry[:2] == (st.st_size, st.st_mtime_ns):
+            files[fn] = entry
+        else:
+            files[fn] = st.st_size, st.st_mtime_ns
+            todo.append(fn)
+    for fn, sha in zip(todo, pmap(arg.jobs, digest, todo)):
+        files[fn] += sha,
+
+    # copies of one image are scanned once
+    summaries = {}
+    todo = {}
+    for fn, (_, _, sha) in files.items():
+        if sha in oldsummaries:
+            summaries[sha] = oldsummaries[sha]
+        else:
+            todo.setdefault(sha, fn)
+    scanned = pmap(arg.jobs, partial(guarded, scan_imports),
+                   list(todo.values()))
+    for sha, result in zip(todo, scanned):
+        if isinstance(result, str):
+            print(f"skipped: {todo[sha]}: {result}")
+            continue
+        summaries[sha] = result
+
+    if files != oldfiles or summaries != oldsummaries:
+        save_pickle(arg.cache, CACHE_VERSION, (files, summaries))
+    return {fn: summaries[sha] for fn, (_, _, sha) in files.items()
+            if sha in summaries}
+
+
+def build_graph(images):
+    # image name -> set of DLL names it imports from, images of one name
+    # (several firmware dumps) merged
+    graph = {}
+    for fn, (_, deps) in images.items():
+        graph.setdefault(basename(fn).split('.')[0].lower(), set()).update(
+            dllbasename(dll) for dll in deps)
+    return graph
+
+
+def cycles(graph):
+    # strongly connected components with more than one node or a self
+    # import, Tarjan's algorithm without recursion
+    index = {}
+    low = {}
+    stack = []
+    onstack = set()
+    found = []
+    for root in sorted(graph):
+        if root in index:
+            continue
+        work = [(root, iter(sorted(graph[root])))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        onstack.add(root)
+        while work:
+            node, deps = work[-1]
+            for dep in deps:
+                if dep not in graph:
+                    continue
+                if dep not in index:
+                    index[dep] = low[dep] = len(index)
+                    stack.append(dep)
+                    onstack.add(dep)
+                    work.append((dep, iter(sorted(graph[dep]))))
+                    break
+                if dep in onstack:
+                    low[node] = min(low[node], index[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    scc = []
+                    while True:
+                        dep = stack.pop()
+                        onstack.discard(dep)
+                        scc.append(dep)
+                        if dep == node:
+                            break
+                    if len(scc) > 1 or node in graph[node]:
+                        found.append(sorted(scc))
+    return found
+
+
+def missing(graph):
+    # DLL name -> names of the images importing it, for DLLs not found
+    ret = {}
+    for name, deps in graph.items():
+        for dep in deps:
+            if dep not in graph:
+                ret.setdefault(dep, []).append(name)
+    return {dep: sorted(names) for dep, names in sorted(ret.items())}
+
+
+def write_dot(fp, graph):
+    fp.write('digraph imports {\n')
+    for name in sorted(graph):
+        for dep in sorted(graph[name]):
+            fp.write(f'\t"{name}" -> "{dep}";\n')
+    fp.write('}\n')
+
+
+def main():
+    par = argparse.ArgumentParser(description="""
+    Build the import dependency graph of a corpus of E32 images and report
+    import cycles and DLLs imported from but not in the corpus. Example:
+    import-graph.py ~/firmware-dumps --dot imports.dot
+    """)
+    par.add_argument('path', nargs='+', help="images or directories of them")
+    par.add_argument('-c', '--cache', default=IMPORTCACHE,
+                     help=f"import summary cache (default: {IMPORTCACHE})")
+    par.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                     help="hash and scan new images in this many processes")
+    par.add_argument('--dot', type=argparse.FileType('w'),
+                     help="also write the graph in Graphviz format here")
+    par.add_argument('-v', '--verbose', action='store_true',
+                     help="list the DLLs and ordinals every image imports")
+
+    arg = par.parse_args()
+    images = summarise(arg)
+    if arg.verbose:
+        for fn, (uid, deps) in sorted(images.items()):
+            print(f"{fn} uid={uid:#010x}")
+            for dll, ordinals in sorted(deps.items()):
+                print(f"\t{dll}: {' '.join(map(str, ordinals))}")
+    graph = build_graph(images)
+    for scc in cycles(graph):
+        print(f"cycle: {' '.join(scc)}")
+    for dep, names in missing(graph).items():
+        print(f"missing: {dep}, imported by {' '.join(names)}")
+    if arg.dot:
+        with arg.dot as fp:
+            write_dot(fp, graph)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import os
+from functools import partial
+from os.path import basename
+from e32exe import scan_exports, resolve_dll, lookup_symbol
+from util.batch import find_images, guarded, load_pickle, pmap, save_pickle
+from util.exportdb import ExportIndex, write_exportdb
+from util.output import atomic_write
+
+MANIFEST_VERSION = 1
+EXPORTDB = os.environ.get('E32EXPORTS', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'e32exports.db'))
+
+
+def load_manifest(path):
+    # abspath -> (size, mtime_ns, iUid3, [(ordinal, code offset)...])
+    return load_pickle(path, MANIFEST_VERSION, {})
+
+
+def imagename(path):
+    return basename(path).split('.')[0].lower()
+
+
+def query(db, spec):
+    # NAME@ORDINAL, NAME (every export of it) or a symbol
+    name, _, ordinal = spec.partition('@')
+    if ordinal:
+        return db.by_ordinal(name, int(ordinal, 0))
+    return db.by_ordinal(name) or db.by_symbol(spec)
+
+
+def main():
+    par = argparse.ArgumentParser(description="""
+    Index the export directories of a corpus of E32 images. Example usage:
+    index-exports.py ~/firmware-dumps; index-exports.py -q euser@123
+    """)
+    par.add_argument('path', nargs='*', help="images or directories of them")
+    par.add_argument('--clean', action='store_true',
+                     help="throw away the current index")
+    par.add_argument('-o', '--output', default=EXPORTDB,
+                     help=f"export index to write (default: {EXPORTDB})")
+    par.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                     help="scan changed images in this many processes")
+    par.add_argument('-q', '--query', action='append', default=[],
+                     help="look up NAME@ORDINAL, NAME or a symbol")
+
+    arg = par.parse_args()
+    if arg.path or arg.clean:
+        index(arg)
+    if arg.query:
+        db = ExportIndex(arg.output)
+        for spec in arg.query:
+            for e in query(db, spec):
+                print(f"{e.name}@{e.ordinal} {e.symbol or '-'} "
+                      f"uid={e.uid:#010x} offset={e.offset:#x} {e.path}")
+
+
+def index(arg):
+    manifest_path = arg.output + '.manifest'
+    old = {} if arg.clean else load_manifest(manifest_path)
+
+    # images already indexed stay unless they are gone
+    manifest = {fn: entry for fn, entry in old.items()
+                if os.path.exists(fn)}
+    todo = []
+    for fn in find_images(arg.path):
+        st = os.stat(fn)
+        entry = old.get(fn)
+        if entry and entry[:2] == (st.st_size, st.st_mtime_ns):
+            continue
+        manifest[fn] = st.st_size, st.st_mtime_ns
+        todo.append(fn)
+
+    if not todo and manifest == old and os.path.exists(arg.output):
+        return
+
+    scanned = pmap(arg.jobs, partial(guarded, scan_exports), todo)
+    for fn, result in zip(todo, scanned):
+        if isinstance(result, str):
+            print(f"skipped: {fn}: {result}")
+            del manifest[fn]
+            continue
+        manifest[fn] += result
+
+    images = []
+    for fn, (_, _, uid, exports) in sorted(manifest.items()):
+        name = imagename(fn)
+        lib = resolve_dll(name)
+        images.append((uid, name, fn, [
+            (ordinal, offset, lib and lookup_symbol(lib, ordinal))
+            for ordinal, offset in exports]))
+
+    atomic_write(arg.output, lambda fp: write_exportdb(fp, images))
+    save_pickle(manifest_path, MANIFEST_VERSION, manifest)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,122 @@
+import contextlib
+import sys
 
 from argparse import ArgumentParser, FileType
-from sisfile import SymbianFileHeader, extract_files
-from e32exe import E32ImageHeader, objcopy
-from util.binfile import ParseError
+from importlib import import_module
+from util.binfile import ParseError, LimitExceeded
+from util.limits import Limits, add_arguments, from_args
+from util.profile import stage
 
+# (module, header type, payload function, magic offset, magic)
+# format modules are only imported once a file looks like theirs
 headers = [
-    (E32ImageHeader, objcopy),
-    (SymbianFileHeader, extract_files),
+    ('e32exe', 'E32ImageHeader', 'objcopy', 16, b'EPOC'),
+    ('sisfile', 'SymbianFileHeader', 'extract_files', 0,
+     0x10201A7A.to_bytes(4, 'little')),
 ]
 
 par = ArgumentParser()
 par.add_argument('-f', '--format', help="Use this format and do not guess")
 par.add_argument('-p', '--parse-only', help="Only parse, do not extract", action='store_true')
+par.add_argument('-s', '--store', help="Store extracted files once in this "
+                 "content-addressed directory and link them into target_dir")
+par.add_argument('--link', choices=('hard', 'reflink', 'copy'), default='hard',
+                 help="How to link stored files into target_dir")
+par.add_argument('-c', '--cache', help="Reuse parse results cached in this "
+                 "directory for files that did not change")
+par.add_argument('--cache-size', type=int, default=1024,
+                 help="Maximum parse cache size, in MiB")
+par.add_argument('--cache-hash', action='store_true',
+                 help="Also key the parse cache on a hash of file contents")
+par.add_argument('--profile', action='store_true',
+                 help="Report time, bytes and peak memory of each stage")
+par.add_argument('--profile-pstats', metavar='FILE',
+                 help="Also dump cProfile stats here (implies --profile)")
+par.add_argument('--profile-trace', metavar='FILE',
+                 help="Also write a Chrome trace of the stages here "
+                 "(implies --profile)")
+par.add_argument('--verify', action='store_true',
+                 help="Check extracted files against the hashes in the SIS "
+                 "package")
+par.add_argument('--progress', action='store_true',
+                 help="Show a progress bar while decompressing")
+par.add_argument('-a', '--archive',
+                 choices=('tar', 'tar.gz', 'tgz', 'tar.zst', 'zip'),
+                 help="Write one archive to target_dir instead of a directory "
+                 "(default if target_dir ends in such a suffix, or is - for "
+                 "a tar archive on stdout)")
+par.add_argument('-v', '--verbose', action='store_true',
+                 help="Log every parsed structure (slow)")
+add_arguments(par)
 par.add_argument('ifile', type=FileType('rb'))
 par.add_argument('target_dir')
 arg = par.parse_args()
 
-with arg.ifile as fp:
-    for HeaderType, payloadfunc in headers:
-        if arg.format and HeaderType.__name__ != arg.format:
+if arg.verbose:
+    import util.binfile
+    util.binfile.VERBOSE = True
+
+redirect = contextlib.nullcontext()
+from util.output import archive_format
+if arg.archive or arg.target_dir == '-' or archive_format(arg.target_dir):
+    if arg.store:
+        par.error("--store links loose files, it cannot go with an archive")
+    from util.output import open_archive
+    fmt = '.' + arg.archive if arg.archive else None
+    if arg.target_dir == '-':
+        # the archive is the output, everything else goes to stderr
+        redirect = contextlib.redirect_stdout(sys.stderr)
+        fmt = fmt or '.tar'
+    target = open_archive(arg.target_dir, fmt)
+elif arg.store:
+    from util.output import ContentStore
+    target = ContentStore(arg.store, arg.target_dir, link=arg.link)
+else:
+    target = arg.target_dir
+
+payloadargs = {}
+if arg.cache:
+    from util.cache import ParseCache
+    payloadargs['cache'] = ParseCache(arg.cache, arg.cache_size << 20,
+                                      arg.cache_hash)
+
+profiler = None
+if arg.profile or arg.profile_pstats or arg.profile_trace:
+    from util.profile import Profiler
+    profiler = Profiler(pstats=arg.profile_pstats).start()
+
+limits = from_args(arg)
+limits = Limits(**limits) if limits else contextlib.nullcontext()
+
+bar = None
+if arg.progress:
+    from util.progress import ProgressBar, set_progress
+    bar = ProgressBar()
+    set_progress(bar)
+
+
+def run(fp):
+    if not fp.seekable():
+        # a pipe or stdin ('-'): parse it in one forward pass
+        from util.stream import ForwardReader
+        fp = ForwardReader(fp)
+    start = fp.read(32)
+    fp.seek(0)
+    for modname, typename, funcname, magicoff, magic in headers:
+        if arg.format:
+            if typename != arg.format:
+                continue
+        elif start[magicoff:magicoff + len(magic)] != magic:
             continue
+        with stage('import'):
+            module = import_module(modname)
+        HeaderType = getattr(module, typename)
+        payloadfunc = getattr(module, funcname)
         try:
-            hdr = HeaderType(fp)
+            with stage('header'):
+                hdr = HeaderType(fp)
+        except LimitExceeded:
+            raise
         except ParseError:
             if arg.format:
                 raise
@@ -29,5 +124,40 @@ with arg.ifile as fp:
             continue
         print(hdr)
         if not arg.parse_only:
-            ff = payloadfunc(fp, hdr, arg.target_dir)
+            if modname == 'sisfile':
+                if arg.verify:
+                    payloadargs['verify'] = module.Verifier()
+                ff = payloadfunc(fp, hdr, target, **payloadargs)
+            else:
+                ff = payloadfunc(fp, hdr, target)
         break
+
+
+def report(verifier):
+    verifier.finish()
+    for name in verifier.mismatched:
+        print(f"hash mismatch: {name}", file=sys.stderr)
+    for name in verifier.missing:
+        print(f"no SHA-1 hash: {name}", file=sys.stderr)
+    print(f"verified {len(verifier.verified)} files, "
+          f"{len(verifier.mismatched)} mismatched, "
+          f"{len(verifier.missing)} without a hash", file=sys.stderr)
+    return not verifier.mismatched
+
+
+try:
+    with arg.ifile as fp, redirect, limits:
+        run(fp)
+    if 'verify' in payloadargs and not report(payloadargs['verify']):
+        raise SystemExit(1)
+finally:
+    if hasattr(target, 'close'):
+        target.close()
+    if bar:
+        bar.close()
+    if profiler:
+        profiler.stop()
+        profiler.report()
+        if arg.profile_trace:
+            with open(arg.profile_trace, 'w') as tfp:
+                profiler.write_trace(tfp)
@@ -0,0 +1,106 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from util.batch import PARSE_ERRORS
+from util.limits import Limits, add_arguments, from_args
+
+# (format, magic offset, magic), as in main.py
+MAGICS = [
+    ('e32', 16, b'EPOC'),
+    ('sis', 0, 0x10201A7A.to_bytes(4, 'little')),
+]
+
+
+def find_files(paths):
+    # paths, directories searched recursively
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                yield from (os.path.join(root, fn) for fn in sorted(files))
+        else:
+            yield path
+
+
+def sniff(fp):
+    head = fp.read(20)
+    fp.seek(0)
+    for fmt, off, magic in MAGICS:
+        if head[off:off + len(magic)] == magic:
+            return fmt
+    return None
+
+
+def inventory(fp, imports=False, limits=None):
+    # the inventory record of fp, errors included rather than raised;
+    # imports: also inflate E32 images as far as their import section;
+    # limits: keyword arguments of a Limits to scan within
+    rec = {'format': None}
+    guard = Limits(**limits) if limits else contextlib.nullcontext()
+    try:
+        with guard:
+            rec['format'] = fmt = sniff(fp)
+            if fmt == 'e32':
+                from e32exe import E32ImageHeader, scan_e32, image_imports
+                header = E32ImageHeader(fp)
+                rec.update(scan_e32(fp, header))
+                if imports:
+                    rec['imports'] = image_imports(fp, header)
+            elif fmt == 'sis':
+                from sisfile import SymbianFileHeader, scan_sis
+                rec.update(scan_sis(fp, SymbianFileHeader(fp)))
+            else:
+                rec['error'] = "unknown format"
+    except (OSError, *PARSE_ERRORS) as e:
+        rec['error'] = str(e)
+    return rec
+
+
+def scan(path, imports=False, limits=None):
+    try:
+        with open(path, 'rb') as fp:
+            rec = {'path': path, **inventory(fp, imports, limits)}
+    except OSError as e:
+        rec = {'path': path, 'format': None, 'error': str(e)}
+    return json.dumps(rec, ensure_ascii=False)
+
+
+def main():
+    par = argparse.ArgumentParser(description="""
+    Print an inventory record of every SIS package and E32 image given, one
+    JSON object per line. Only headers and SIS controllers are read, file
+    data is never decompressed. Example: scan.py -j 8 ~/archive > inv.ndjson
+    """)
+    par.add_argument('path', nargs='*', help="files or directories of them")
+    par.add_argument('--from', dest='list', type=argparse.FileType('r'),
+                     help="also scan the paths listed in this file, one per "
+                     "line ('-' for stdin)")
+    par.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                     help="scan in this many processes")
+    par.add_argument('-i', '--imports', action='store_true',
+                     help="also list the DLLs and ordinals images import "
+                     "(inflates their code up to the import section)")
+    add_arguments(par)
+
+    arg = par.parse_args()
+    paths = find_files(arg.path)
+    if arg.list:
+        paths = [*paths, *find_files(line.rstrip('\n') for line in arg.list
+                                     if line.strip())]
+    out = sys.stdout
+    func = partial(scan, imports=arg.imports, limits=from_args(arg))
+    if arg.jobs > 1:
+        with ProcessPoolExecutor(arg.jobs) as pool:
+            for line in pool.map(func, paths, chunksize=64):
+                out.write(line + '\n')
+    else:
+        for line in map(func, paths):
+            out.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
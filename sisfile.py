@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import os
+import zlib
+from collections import namedtuple
 from enum import IntEnum
 from util.binfile import (
     Structure,
@@ -18,8 +20,17 @@ from util.binfile import (
     UInt8,
     UTF16String,
     Array,
+    LazyArray,
     UnknownPayload,
+    ParseError,
+    drop_offsets,
+    debug,
 )
+from util.crc import crc16
+from util.limits import limits
+from util.output import get_output
+from util.profile import stage
+from util.progress import progress, source_size
 
 # based on format documentation from:
 # https://web.archive.org/web/20101011053920/http://developer.symbian.org/wiki/images/b/b7/SymbianOSv9.x_SIS_File_Format_Specification.pdf
@@ -89,6 +100,10 @@ class TCompressionAlgorithm(IntEnum):
     SISCompressedNone, SISCompressedDeflate = range(2)
 
 
+class TSISHashAlgorithm(IntEnum):
+    EHashAlgSHA1 = 1
+
+
 class TLanguage(IntEnum):
     C, EN = range(2)  # made-up names
 
@@ -100,6 +115,22 @@ class SISField(Structure):
     Length : EfficientUInt63
     Length : StructurePayloadLength
 
+    def _tobytes(self, typed=True):
+        # Length is recomputed; array elements go without their Type
+        payload = b''.join(self._fieldbytes(skip=('Type', 'Length')))
+        head = EfficientUInt63(len(payload))._tobytes()
+        if typed:
+            head = self._dumpfield('Type') + head
+        return head + payload + bytes(-len(head + payload) % self.ALIGNMENT)
+
+    @classmethod
+    def _skip(cls, fp):
+        # over one array element (no Type) without parsing it
+        at = fp.tell()
+        fp.seek(at + -at % cls.ALIGNMENT)
+        length = EfficientUInt63(fp)
+        fp.seek(length, os.SEEK_CUR)
+
 
 class SISString(SISField):
     # UCS-2 encoded unicode string
@@ -114,6 +145,17 @@ class SISArray(SISField):
     def init_common(self, obj):
         obj.Type = self.SISFieldType
 
+    def _fieldbytes(self, skip=()):
+        yield self._dumpfield('SISFieldType')
+        for obj in self.Contents:
+            yield obj._tobytes(typed=False)
+
+
+class SISLazyArray(SISArray):
+    # elements parsed only when indexed, see LazyArray; for SISData, which
+    # is read straight from the (seekable) file
+    Contents : LazyArray['_tp']
+
 
 class SISCompressed(SISField):
     _subclassfield = 'Algorithm'
@@ -121,6 +163,17 @@ class SISCompressed(SISField):
     Algorithm : BuildEnum(TUint32, TCompressionAlgorithm)
     UncompressedDataSize : TUint64
 
+    def _fieldbytes(self, skip=()):
+        tp = self.__annotations_all__['CompressedData']
+        if issubclass(tp, Zlib):
+            raw = tp._tp._dump(self.CompressedData)
+            data = zlib.compress(raw)
+        else:
+            raw = data = tp._dump(self.CompressedData)
+        yield self._dumpfield('Algorithm')
+        yield TUint64(len(raw))._tobytes()
+        yield data
+
 
 class SISCompressedNone(SISCompressed):
     CompressedData : '_tp'
@@ -316,6 +369,8 @@ class SISController(SISField):
     # "This field is optional"
     Logo : SISLogo
     InstallBlock : SISInstallBlock
+    InstallBlock : SkipNextIfByte('Signature0', TField.SISDataIndex & 255)
+    # unsigned packages have no signatures at all
     Signature0 : SISSignatureCertificateChain
     DataIndex : SISDataIndex
 
@@ -327,11 +382,11 @@ class SISFileData(SISField):
 
 # reordered before SISData
 class SISDataUnit(SISField):
-    FileData : SISArray[SISFileData]
+    FileData : SISLazyArray[SISFileData]
 
 
 class SISData(SISField):
-    DataUnits : SISArray[SISDataUnit]
+    DataUnits : SISLazyArray[SISDataUnit]
 
 
 class SISContents(SISField):
@@ -363,14 +418,386 @@ class SISIf(SISField):
     ElseIfs : SISArray[SISElseIf]
 
 
-def extract_files(fp, header, target_dir):
-    ff = SISField(fp)
+def _parse_compact(fp):
+    contents = SISField(fp)
+    drop_offsets(contents)
+    return contents
+
+
+def parse_contents(fp, cache=None, offsets=True):
+    # offsets=False frees the per-field offsets once the tree is
+    # validated; write_sis needs them, extraction does not
+    parse = SISField if offsets else _parse_compact
+    with stage('parse'):
+        if cache is None:
+            return parse(fp)
+        return cache.load(fp, 'SISContents' if offsets
+                          else 'SISContents/compact', parse)
+
+
+class Verifier:
+    # Checks extracted payloads against the SISHash of their
+    # SISFileDescription. Whole payloads are hashed on a thread pool
+    # (hashlib lets go of the GIL) while the next ones are decompressed;
+    # a payload still coming in chunks is hashed as they go by. Either
+    # way nothing is read twice.
+    def __init__(self, workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self._pool = ThreadPoolExecutor(workers)
+        self._pending = []  # (name, expected digest, future or hash)
+        self.verified = []
+        self.mismatched = []
+        self.missing = []  # no hash, or not a SHA-1 one
+
+    def add(self, f, data):
+        # data as passed to output.add; returns what to pass instead
+        import hashlib
+        name = target_name(f)
+        expected = f.Hash.HashData.Blob
+        if f.Hash.HashAlgorithm != TSISHashAlgorithm.EHashAlgSHA1 \
+                or not expected:
+            self.missing.append(name)
+            return data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self._pending.append((name, expected,
+                                  self._pool.submit(hashlib.sha1, data)))
+            return data
+        h = hashlib.sha1()
+        self._pending.append((name, expected, h))
+        return self._hashing(data, h)
+
+    @staticmethod
+    def _hashing(chunks, h):
+        for chunk in chunks:
+            h.update(chunk)
+            yield chunk
+
+    def finish(self):
+        # wait for every digest; True if all matched
+        for name, expected, h in self._pending:
+            if not hasattr(h, 'digest'):
+                h = h.result()
+            if h.digest() == expected:
+                self.verified.append(name)
+            else:
+                self.mismatched.append(name)
+        self._pending = []
+        self._pool.shutdown()
+        return not self.mismatched
+
+
+def extract_files(fp, header, target_dir, cache=None, verify=None):
+    # verify: a Verifier to check the payloads with
+    if not fp.seekable():
+        return extract_stream(fp, header, target_dir, verify)
+    output = get_output(target_dir)
+    prog = progress('sis', source_size(fp))
+    ff = parse_contents(fp, cache, offsets=False)
     for f in ff.Controller.CompressedData.InstallBlock.Files.Contents:
         fd = ff.Data.DataUnits.Contents[0].FileData.Contents[f.FileIndex]
-        print(fd.FileData.CompressedData)
-        print(f.Target)
-        print(f.MIMEType)
-        name = os.path.join(target_dir, f.Target.String.split('\\')[-1] or "%d"%f.FileIndex)
-        with open(name, 'wb') as ofp:
-            ofp.write(fd.FileData.CompressedData)
+        debug("%r: %r, %d bytes", f.Target, f.MIMEType,
+                  len(fd.FileData.CompressedData))
+        data = fd.FileData.CompressedData
+        if verify is not None:
+            data = verify.add(f, data)
+        with stage('write', len(data)):
+            output.add(target_name(f), data)
+        if prog is not None:
+            # fp itself is long past: the lazy arrays hopped to the end
+            prog.update(_element_end(fd), prog.produced + len(data))
+    if prog is not None:
+        prog.done()
     return ff
+
+
+# a file payload in SISData: unit and index within it, how it is stored,
+# its uncompressed size, and where the stored bytes are in the file
+FileDataEntry = namedtuple('FileDataEntry',
+                           'unit index algorithm size offset length')
+
+
+def _fieldhead(fp, tp=None):
+    # skip padding, read a field's type (unless given, as for array
+    # elements) and length; returns (type, length, payload offset)
+    at = fp.tell()
+    fp.seek(at + -at % SISField.ALIGNMENT)
+    if tp is None:
+        tp = _readenum(fp, TField)
+    return tp, EfficientUInt63(fp), fp.tell()
+
+
+def _readenum(fp, enum):
+    # a 32-bit enum value, ParseError if it is not one
+    at = fp.tell()
+    raw = int.from_bytes(fp.read(4), 'little', signed=True)
+    try:
+        return enum(raw)
+    except ValueError:
+        raise ParseError(f"unknown {enum.__name__} {raw} at offset {at}")
+
+
+def _expect(tp, want):
+    if tp != want:
+        raise ParseError(f"expected {want!r}, found {tp!r}")
+
+
+def iter_file_data(fp):
+    # Walk the SISData at fp (as left by parse_controller) by its field
+    # headers only, yielding a FileDataEntry per file without reading or
+    # decompressing any payload.
+    tp, _, _ = _fieldhead(fp)
+    _expect(tp, TField.SISData)
+    tp, length, at = _fieldhead(fp)
+    _expect(tp, TField.SISArray)
+    _expect(_readenum(fp, TField), TField.SISDataUnit)
+    units_end = at + length
+    unit = 0
+    while fp.tell() + SISField.ALIGNMENT <= units_end:
+        _, ulen, uat = _fieldhead(fp, TField.SISDataUnit)
+        tp, length, at = _fieldhead(fp)
+        _expect(tp, TField.SISArray)
+        _expect(_readenum(fp, TField), TField.SISFileData)
+        index = 0
+        while fp.tell() + SISField.ALIGNMENT <= at + length:
+            _, dlen, dat = _fieldhead(fp, TField.SISFileData)
+            tp, clen, cat = _fieldhead(fp)
+            _expect(tp, TField.SISCompressed)
+            algorithm = _readenum(fp, TCompressionAlgorithm)
+            size = int.from_bytes(fp.read(8), 'little')
+            yield FileDataEntry(unit, index, algorithm, size,
+                                cat + 12, clen - 12)
+            fp.seek(dat + dlen)
+            index += 1
+        fp.seek(uat + ulen)
+        unit += 1
+
+
+def target_name(f):
+    # where a SISFileDescription is extracted to, within target_dir
+    return f.Target.String.split('\\')[-1] or "%d"%f.FileIndex
+
+
+def parse_controller(fp):
+    # SISContents up to the controller, without touching SISData;
+    # fp is left at the start of SISData
+    contents = SISContents()
+    contents._at = fp.tell()
+    contents.Type = contents.__annotations_all__['Type'](fp)
+    if contents.Type != TField.SISContents:
+        raise ParseError(f"expected SISContents, found {contents.Type!r}")
+    start = fp.tell()
+    contents.Length = EfficientUInt63(fp)
+    contents._setoffsets('Length', start, fp.tell())
+    for field in 'ControllerChecksum', 'DataChecksum', 'Controller':
+        setattr(contents, field, contents.__annotations_all__[field](fp))
+    return contents
+
+
+def _strings(arr):
+    return [s.String for s in arr.Contents]
+
+
+def _version(v):
+    return None if v is None else [v.Major, v.Minor, v.Build]
+
+
+def _dependency(dep):
+    vr = dep.VersionRange
+    return {
+        'uid': dep.UID.UID1,
+        'from': _version(vr.FromVersion),
+        'to': _version(getattr(vr, 'ToVersion', None)),
+        'names': _strings(dep.DependencyNames),
+    }
+
+
+def scan_sis(fp, header):
+    # Inventory record of a package, made of plain types for JSON. Only
+    # the controller is decompressed, SISData is never touched.
+    c = parse_controller(fp).Controller.CompressedData
+    info = c.Info
+    d, t = info.CreationTime.Date, info.CreationTime.Time
+    return {
+        'uids': [header.UID1, header.UID2, header.UID3],
+        'uid': info.UID.UID1,
+        'vendor': info.VendorUniqueName.String,
+        'names': _strings(info.Names),
+        'vendor_names': _strings(info.VendorNames),
+        'version': _version(info.Version),
+        'created': f'{d.Year:04}-{d.Month + 1:02}-{d.Day:02}T'
+                   f'{t.Hours:02}:{t.Minutes:02}:{t.Seconds:02}',
+        'install_type': info.InstallType,
+        'install_flags': info.InstallFlags,
+        'languages': [lang.Language.name
+                      for lang in c.Languages.Languages.Contents],
+        'target_devices': [_dependency(dep) for dep in
+                           c.Prerequisites.TargetDevices.Contents],
+        'dependencies': [_dependency(dep) for dep in
+                         c.Prerequisites.Dependencies.Contents],
+        'files': [{
+            'target': f.Target.String,
+            'mime': f.MIMEType.String,
+            'size': f.UncompressedLength,
+            'stored': f.FileLength,
+            'sha1': bytes(f.Hash.HashData.Blob).hex() or None
+                    if f.Hash.HashAlgorithm == TSISHashAlgorithm.EHashAlgSHA1
+                    else None,
+            'operation': f.Operation,
+            'options': f.OperationOptions,
+            'index': f.FileIndex,
+        } for f in c.InstallBlock.Files.Contents],
+    }
+
+
+def _inflating(chunks, bufsize=1 << 20):
+    # zlib-decompressed chunks, at most bufsize bytes at a time however
+    # well they were compressed, within the active Limits
+    guard = limits()
+    obj = zlib.decompressobj()
+    consumed = produced = 0
+    for chunk in chunks:
+        consumed += len(chunk)
+        while chunk:
+            out = obj.decompress(chunk, bufsize)
+            chunk = obj.unconsumed_tail
+            if guard is not None:
+                produced += len(out)
+                guard.produced(produced, consumed - len(chunk),
+                               'SISData payload')
+            yield out
+    yield obj.flush()
+
+
+def inflate(data):
+    # zlib.decompress, unless there are Limits to keep to
+    if limits() is None:
+        return zlib.decompress(data)
+    return b''.join(_inflating((data,)))
+
+
+def _stored_chunks(fp, entry, bufsize):
+    fp.seek(entry.offset)
+    left = entry.length
+    while left:
+        chunk = fp.read(min(left, bufsize))
+        if not chunk:
+            raise EOFError("source ended prematurely")
+        left -= len(chunk)
+        yield chunk
+
+
+def _payload_chunks(fp, entry, bufsize=1 << 16):
+    # the (uncompressed) contents of a FileDataEntry, a block at a time
+    guard = limits()
+    if guard is not None:
+        guard.declared(entry.size, 'SISData payload')
+    chunks = _stored_chunks(fp, entry, bufsize)
+    if entry.algorithm == TCompressionAlgorithm.SISCompressedDeflate:
+        return _inflating(chunks)
+    return chunks
+
+
+def _element_end(field):
+    # where a parsed array element (no Type) ends in the file: its Length,
+    # then that many bytes
+    return (field._at + len(EfficientUInt63(field.Length)._tobytes())
+            + field.Length)
+
+
+def _reporting(chunks, entry, prog):
+    # bytes consumed are told by where the payload is and how much of it
+    # has come out, not by wherever fp happens to be
+    base = prog.produced
+    done = 0
+    for chunk in chunks:
+        done += len(chunk)
+        frac = min(done / entry.size, 1) if entry.size else 1
+        prog.update(entry.offset + int(entry.length * frac), base + done)
+        yield chunk
+
+
+def extract_stream(fp, header, target_dir, verify=None):
+    # One forward pass, for input that cannot seek (see util.stream): the
+    # controller, then every payload written out as it goes by.
+    output = get_output(target_dir)
+    prog = progress('sis')
+    with stage('parse'):
+        contents = parse_controller(fp)
+    files = {}
+    for f in contents.Controller.CompressedData.InstallBlock.Files.Contents:
+        files.setdefault(f.FileIndex, []).append(f)
+    for entry in iter_file_data(fp):
+        # like extract_files, only the first data unit is extracted
+        descs = files.get(entry.index) if entry.unit == 0 else None
+        if not descs:
+            continue
+        data = _payload_chunks(fp, entry)
+        if prog is not None:
+            data = _reporting(data, entry, prog)
+        # decompression happens as the chunks are written
+        with stage('zlib+write', entry.length) as st:
+            if len(descs) > 1:
+                data = b''.join(data)
+            for f in descs:
+                if verify is not None:
+                    data = verify.add(f, data)
+                output.add(target_name(f), data, entry.size)
+            st.bytes_out = entry.size
+    if prog is not None:
+        prog.done()
+    return contents
+
+
+def _payload_end(field):
+    return field._roffset('Length') + field.Length
+
+
+def copy_range(fp, ofp, offset, length):
+    # in-kernel copy where possible, large block copies otherwise
+    ofp.flush()
+    copied = False
+    try:
+        while length:
+            n = os.copy_file_range(fp.fileno(), ofp.fileno(), length, offset)
+            if not n:
+                raise EOFError("source ended prematurely")
+            copied = True
+            offset += n
+            length -= n
+    except (AttributeError, OSError):
+        # no copy_file_range (or not for these files, or not past some
+        # point): the rest is copied below
+        pass
+    if copied:
+        # the kernel moved the file offset behind the buffered writer's
+        # back, also if it gave up part way
+        ofp.seek(os.lseek(ofp.fileno(), 0, os.SEEK_CUR))
+    if not length:
+        return
+    fp.seek(offset)
+    while length:
+        buf = fp.read(min(length, 1 << 20))
+        if not buf:
+            raise EOFError("source ended prematurely")
+        ofp.write(buf)
+        length -= len(buf)
+
+
+def write_sis(fp, ofp, header, contents):
+    # Write a SIS file to ofp: header and the (possibly modified) contents
+    # as parsed from fp. Only the controller is re-encoded, SISData is
+    # copied verbatim from fp, so its checksum stays valid as it is.
+    controller = contents.Controller._tobytes()
+    contents.ControllerChecksum.Checksum = TUint16(crc16(controller))
+    data_at = _payload_end(contents.Controller)
+    data_at += -data_at % SISField.ALIGNMENT
+    data_len = _payload_end(contents) - data_at
+
+    body = (contents.ControllerChecksum._tobytes()
+            + contents.DataChecksum._tobytes() + controller)
+    ofp.write(header._tobytes())
+    ofp.write(contents._dumpfield('Type'))
+    ofp.write(EfficientUInt63(len(body) + data_len)._tobytes())
+    ofp.write(body)
+    copy_range(fp, ofp, data_at, data_len)
+    ofp.write(bytes(-data_len % SISField.ALIGNMENT))
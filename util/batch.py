@@ -0,0 +1,62 @@
+import os
+import pickle
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from util.output import atomic_write
+
+# Shared by the tools that go over a whole corpus of images
+# (index-exports.py, import-graph.py, gen-e32def.py, catalog.py).
+
+# what a corrupt or unsupported input may raise while being parsed
+PARSE_ERRORS = (ValueError, EOFError, IndexError, KeyError,
+                NotImplementedError, OverflowError, struct.error, zlib.error)
+
+
+def find_images(paths):
+    # every E32 image in paths, directories searched recursively
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                yield from find_images(os.path.join(root, fn)
+                                       for fn in sorted(files))
+            continue
+        with open(path, 'rb') as fp:
+            if fp.read(20)[16:] == b'EPOC':
+                yield os.path.abspath(path)
+
+
+def guarded(func, path):
+    # func(path), or why it could not be parsed; picklable with partial,
+    # for pmap
+    try:
+        return func(path)
+    except PARSE_ERRORS as e:
+        return str(e)
+
+
+def pmap(jobs, func, items):
+    if len(items) > 1 and jobs > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            return list(pool.map(func, items, chunksize=16))
+    return list(map(func, items))
+
+
+def load_pickle(path, version, default):
+    # what save_pickle saved, default if it is missing, broken or of
+    # another version
+    try:
+        with open(path, 'rb') as fp:
+            saved, data = pickle.load(fp)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError):
+        return default
+    if saved != version:
+        return default
+    return data
+
+
+def save_pickle(path, version, data):
+    atomic_write(path, lambda fp: pickle.dump((version, data), fp,
+                                              pickle.HIGHEST_PROTOCOL))
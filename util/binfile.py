@@ -1,15 +1,63 @@
 
+import copyreg
 import os
+import sys
+import threading
 import zlib
+from array import array
+from collections import OrderedDict
 from enum import Enum, EnumMeta
 from io import BytesIO
 from struct import Struct
+from types import MappingProxyType
+from weakref import WeakKeyDictionary
+
+from util.limits import limits
+from util.profile import stage
+from util.progress import progress
+
+# Debug output of everything parsed (main.py -v), to stderr. Off by
+# default: formatting it took most of the parse time.
+VERBOSE = False
+
+
+def debug(msg, *args):
+    if VERBOSE:
+        print(msg % args, file=sys.stderr)
 
 
 def TellFile(fp):
     return fp
 
 
+class BufferFile:
+    # read-only file over a buffer (e.g. a memoryview), nothing but what
+    # is read gets copied, unlike BytesIO(bytearray)
+    def __init__(self, buf):
+        self._buf = memoryview(buf).cast('B')
+        self._pos = 0
+
+    def read(self, n=-1):
+        end = len(self._buf) if n is None or n < 0 else self._pos + n
+        data = bytes(self._buf[self._pos:end])
+        self._pos += len(data)
+        return data
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._buf)
+        self._pos = offset
+        return offset
+
+    def getbuffer(self):
+        return self._buf
+
+
 class Unknown(float):
     def __repr__(self):
         return "UNKNOWN"
@@ -39,7 +87,7 @@ class StructurePayloadLength(Attribute):
     def mkvalidator(key):
         def ret(self):
             value = getattr(self, key)
-            actual = self._fin - self._actual_roffsets[key]
+            actual = self._fin - self._roffset(key)
             padsize = -actual % self.ALIGNMENT
             if value < actual or value > actual + padsize:
                 raise ParseError(f"{type(self).__name__} at offset {self._at}:"
@@ -51,7 +99,7 @@ class StructurePayloadLength(Attribute):
     def parsedhook(key):
         def ret(self):
             value = getattr(self, key)
-            self._maxfin = self._actual_roffsets[key] + value
+            self._maxfin = self._roffset(key) + value
             #print(f"Fixed maxfin to {self._maxfin=}")
         return ret
 
@@ -61,7 +109,7 @@ class StructureTotalLength(Attribute):
     def mkvalidator(key):
         def ret(self):
             value = getattr(self, key)
-            actual = self._fin - next(iter(self._actual_offsets.values()))
+            actual = self._fin - self._offs[0]
             padsize = -actual % self.ALIGNMENT
             if value < actual or value > actual + padsize:
                 raise ParseError(f"{type(self).__name__} at offset {self._at}:"
@@ -73,7 +121,7 @@ class StructureTotalLength(Attribute):
     def parsedhook(key):
         def ret(self):
             value = getattr(self, key)
-            self._maxfin = next(iter(self._actual_offsets.values())) + value
+            self._maxfin = self._offs[0] + value
             #print(f"Fixed maxfin to {self._maxfin=}")
         return ret
 
@@ -85,7 +133,7 @@ class LengthIn(Attribute):
     def preparsehook(self, key):
         def ret(self2):
             value = getattr(self2, self._field)
-            value = self2._actual_offsets[key] + value
+            value = self2._offset(key) + value
             return {'_maxfin2': value}
         return ret
 
@@ -105,7 +153,7 @@ class CanBeLast(Attribute):
     @staticmethod
     def parsedhook(key):
         def ret(self):
-            if self._actual_roffsets[key] == self._maxfin:
+            if self._roffset(key) == self._maxfin:
                 return True
         return ret
 
@@ -142,14 +190,81 @@ class StructureAnnotations(dict):
         return super().__setitem__(key, val)
 
 
+_NOOFFSETS = array('q', (-1, -1))
+_UNSET = object()
+
+
+def drop_offsets(obj):
+    # Free the parse bookkeeping (field offsets, limits) of a parsed tree,
+    # once nothing is going to validate or re-encode it by offset.
+    if isinstance(obj, list):
+        for item in obj:
+            drop_offsets(item)
+    if not isinstance(obj, Structure) or obj._value('_offs') is None:
+        return
+    obj._offs = None
+    for name in '_maxfin', '_fin':
+        try:
+            delattr(obj, name)
+        except AttributeError:
+            pass
+    for field in obj.__annotations_all__:
+        drop_offsets(obj._value(field))
+
+
 class ParseError(ValueError):
     pass
 
 
+class LimitExceeded(ParseError):
+    # input over a budget of the active util.limits.Limits
+    pass
+
+
 class TemplateNeeded(ValueError):
     pass
 
 
+# Template instantiations are memoised so that e.g. SISArray[SISString] is
+# one class no matter how many times (or processes, or threads at once) it
+# gets instantiated. Classes are only published once complete, and are not
+# changed afterwards.
+_templates = {}
+_templates_lock = threading.RLock()
+
+# Files that are seeked again after parsing (by LazyArray) may be shared
+# between threads: one lock per file object.
+_filelocks = WeakKeyDictionary()
+_filelocks_lock = threading.Lock()
+
+
+def _filelock(fp):
+    with _filelocks_lock:
+        try:
+            return _filelocks.setdefault(fp, threading.RLock())
+        except TypeError:
+            # cannot be weakly referenced, share a lock with all such files
+            return _templates_lock
+
+
+def _instantiated(cls, args):
+    return cls._instantiate(dict(args))
+
+
+# per-instance parse state of every slotted Structure, next to its fields
+_BOOKKEEPING = '_at', '_maxfin', '_fin', '_file', '_offs', '_lazy'
+
+
+def _slotted(cls):
+    return issubclass(cls, Structure) and not cls.__dictoffset__
+
+
+def _reduce_class(cls):
+    # classes made at runtime are pickled as the recipe that rebuilds them,
+    # anything else by its importable name
+    return cls.__dict__.get('_recipe') or cls.__qualname__
+
+
 class StructureMeta(type):
     @classmethod
     def __prepare__(meta, name, bases):
@@ -160,6 +275,7 @@ class StructureMeta(type):
             '_offsets': {},
             '_validators': [],
             '_hooks': {},
+            '_defaults': {},
             'SIZE': 0,
         })
         for base in bases:
@@ -171,6 +287,8 @@ class StructureMeta(type):
                 d['_offsets'].update(base._offsets)
             if hasattr(base, '_hooks'):
                 d['_hooks'].update(base._hooks)
+            if hasattr(base, '_defaults'):
+                d['_defaults'].update(base._defaults)
             #if hasattr(base, '_struct'):
             #    d['_struct'] = base._struct
             #if hasattr(base, '_rdstruct'):
@@ -188,15 +306,40 @@ class StructureMeta(type):
             annotations_all.update(getattr(base, '__annotations_all__', ()))
         annotations_all.update(dic.get('__annotations__', ()))
         dic['__annotations_all__'] = annotations_all
+        dic['_fieldindex'] = {f: i for i, f in enumerate(annotations_all)}
         if hasattr(dic.get('_struct'), 'size'):
             dic['SIZE'] = dic['_struct'].size
+        # field defaults live in _defaults, not as class attributes, so
+        # that they cannot shadow the slot of the field
+        dic['_defaults'] = defaults = dict(dic.get('_defaults', ()))
+        for field in annotations_all:
+            if field in dic:
+                defaults[field] = dic.pop(field)
+        if bases and all(map(_slotted, bases)):
+            # all of the layout is ours: generate __slots__ for the fields
+            # (and parse state, at the first level) that bases do not have
+            inherited = set()
+            for base in bases:
+                inherited.update(base._allslots)
+            own = [*dic.get('__slots__', ())]
+            if '_offs' not in inherited:
+                own.extend(_BOOKKEEPING)
+            own.extend(annotations_all)
+            dic['__slots__'] = tuple(dict.fromkeys(
+                f for f in own if f not in inherited))
+            dic['_allslots'] = (*inherited, *dic['__slots__'])
+        # the layout is fixed from here on, safe to share between threads
+        dic['_validators'] = tuple(dic.get('_validators', ()))
+        for attr in '_hooks', '_defaults', '_fieldindex', '__annotations_all__':
+            dic[attr] = MappingProxyType(dict(dic.get(attr, ())))
         cls = type.__new__(metacl, name, bases, dic)
         subclassfield = getattr(cls.__base__, '_subclassfield', None)
         if subclassfield:
             try:
-                setattr(cls, subclassfield,
-                        getattr(cls.__base__.__annotations__[subclassfield],
-                                cls.__name__))
+                cls._defaults = MappingProxyType({
+                    **cls._defaults, subclassfield: getattr(
+                        cls.__base__.__annotations__[subclassfield],
+                        cls.__name__)})
             except AttributeError:
                 pass
         return cls
@@ -211,17 +354,43 @@ class StructureMeta(type):
             bases = bases,
         dic = meta.__prepare__(name, bases)
         dic['_struct'] = dic['_rdstruct'] = struc
+        # like namedtuple: belong to the caller, so pickle can find us
+        dic['__module__'] = sys._getframe(1).f_globals.get('__name__')
         return meta(name, bases, dic)
 
     def _instantiate(cls, args):
-        cls = type(cls)(cls.__name__, (cls,), cls.__dict__.copy())
+        key = cls, tuple(args.items())
+        try:
+            return _templates[key]
+        except KeyError:
+            pass
+        with _templates_lock:
+            # another thread may have finished it while we waited
+            try:
+                return _templates[key]
+            except KeyError:
+                pass
+            _templates[key] = cls = cls._instantiate_new(key, args)
+            return cls
+
+    def _instantiate_new(cls, key, args):
+        # slots (and their descriptors) are inherited, not redeclared
+        dic = {k: v for k, v in cls.__dict__.items()
+               if k not in cls.__dict__.get('__slots__', ())
+               and k not in ('__slots__', '_allslots', '__dict__',
+                             '__weakref__')}
+        cls = type(cls)(cls.__name__, (cls,), dic)
+        cls._recipe = _instantiated, key
         cls._template_args = args
         template = list(cls._template)
-        for field, tp in cls.__annotations_all__.items():
+        annotations = dict(cls.__annotations_all__)
+        for field, tp in annotations.items():
             if tp in args:
-                cls.__annotations_all__[field] = args[tp]
-            elif issubclass(tp, Structure):
-                cls.__annotations_all__[field] = tp._instantiate(args)
+                annotations[field] = args[tp]
+            elif issubclass(tp, Structure) and tp._template:
+                # fully specified types have nothing to substitute
+                annotations[field] = tp._instantiate(args)
+        cls.__annotations_all__ = MappingProxyType(annotations)
         for pattern, value in args.items():
             try:
                 idx = template.index(pattern)
@@ -249,6 +418,10 @@ class StructureMeta(type):
 
 
 class Structure(metaclass=StructureMeta):
+    # empty, so that int and list can still be mixed in; plain subclasses
+    # get generated __slots__ (see StructureMeta), the others a __dict__
+    __slots__ = ()
+    _allslots = ()
     _template = ()
     _template_args = ()
     ALIGNMENT = 1
@@ -272,7 +445,80 @@ class Structure(metaclass=StructureMeta):
             validator(self)
 
     def _tobytes(self):
-        return self._struct.pack(self)
+        if hasattr(self, '_struct'):
+            return self._struct.pack(self)
+        return b''.join(self._fieldbytes())
+
+    def _fieldbytes(self, skip=()):
+        # only what was parsed or set, not class defaults of missing fields
+        for field, tp in self.__annotations_all__.items():
+            val = self._value(field)
+            if val is not None and field not in skip:
+                yield tp._dump(val)
+
+    def _value(self, field, default=None):
+        # the field as parsed or set on this instance, default if it was not
+        try:
+            return object.__getattribute__(self, field)
+        except AttributeError:
+            return self._unlazy(field, default)
+
+    def _unlazy(self, field, default):
+        # fields of a tree decoded lazily by util.treecodec are decoded
+        # on first access
+        try:
+            dec, pending = object.__getattribute__(self, '_lazy')
+        except AttributeError:
+            return default
+        return dec.resolve(self, field, pending, default)
+
+    def __getattr__(self, name):
+        # only reached for fields not set on the instance
+        val = self._unlazy(name, _UNSET)
+        if val is not _UNSET:
+            return val
+        try:
+            return type(self)._defaults[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def _copystate(self, other):
+        for name in other._allslots:
+            try:
+                setattr(self, name, object.__getattribute__(other, name))
+            except AttributeError:
+                pass
+        if hasattr(other, '__dict__'):
+            self.__dict__.update(other.__dict__)
+
+    def _offset(self, field):
+        # where field started (padding included), and where it ended
+        if self._offs is None:
+            raise ValueError(f"offsets of {type(self).__name__} were dropped")
+        return self._offs[2 * self._fieldindex[field]]
+
+    def _roffset(self, field):
+        if self._offs is None:
+            raise ValueError(f"offsets of {type(self).__name__} were dropped")
+        return self._offs[2 * self._fieldindex[field] + 1]
+
+    def _setoffsets(self, field, start, end=-1):
+        idx = 2 * self._fieldindex[field]
+        self._offs[idx] = start
+        self._offs[idx + 1] = end
+
+    def _dumpfield(self, field):
+        return self.__annotations_all__[field]._dump(getattr(self, field))
+
+    @classmethod
+    def _dump(cls, val):
+        # bytes of val, the value of a field annotated with this type
+        if not isinstance(val, Structure):
+            if issubclass(cls, Enum):
+                # parsed enum values are members of the plain enum
+                return cls._struct.pack(val)
+            val = cls(val)
+        return val._tobytes()
 
     @classmethod
     def __new__(cls, subcl, parseobj=None, parsefile=None, init_common=None):
@@ -280,15 +526,17 @@ class Structure(metaclass=StructureMeta):
             raise TemplateNeeded(cls.__name__)
         if isinstance(parseobj, Structure):
             self = super().__new__(subcl)
-            self.__dict__.update(parseobj.__dict__)
+            self._copystate(parseobj)
+            # retyped to a subclass: room for the offsets of its fields
+            self._offs = self._offs + _NOOFFSETS * (
+                len(subcl._fieldindex) - len(self._offs) // 2)
             maxfin = self._maxfin
         else:
-            parsefile, maxfin = cls._parsefile(parseobj)
             self = super().__new__(subcl)
-            self._actual_offsets = {}
-            self._actual_roffsets = {}
-        if parseobj is None:
-            return self
+            self._offs = _NOOFFSETS * len(subcl._fieldindex)
+            if parseobj is None:
+                return self
+            parsefile, maxfin = cls._parsefile(parseobj)
         self._at = offset = parsefile.tell()
         padlen = -offset % cls.ALIGNMENT
         if padlen:
@@ -303,10 +551,15 @@ class Structure(metaclass=StructureMeta):
         if init_common:
             init_common(self)
         self._file = parsefile
+        guard = limits()
+        if guard is not None:
+            guard.enter(subcl.__name__)
         try:
             return self._parse(parsefile)
         finally:
             self._file = None
+            if guard is not None:
+                guard.leave()
 
     def _peekbyte(self):
         if self._file is None:
@@ -325,20 +578,21 @@ class Structure(metaclass=StructureMeta):
                 namemap = cls._named(*vals)._asdict()
             else:
                 namemap = dict(enumerate(vals))
-            self.__dict__.update(namemap)
             for k, v in namemap.items():
+                setattr(self, k, v)
                 # TODO
-                self._actual_offsets[k] = offset
-                self._actual_roffsets[k] = parsefile.tell()
+                if k in self._fieldindex:
+                    self._setoffsets(k, offset, parsefile.tell())
         retype = False
         for field, tp in cls.__annotations_all__.items():
-            if field in self.__dict__:
+            if self._value(field, _UNSET) is not _UNSET:
                 continue
             #print(f"{subcl.__name__} at offset {offset}: "
-            #      f"parsing a {tp} {field}\n ({self.__dict__=})")
-            self._actual_offsets[field] = parsefile.tell()
+            #      f"parsing a {tp} {field}")
+            start = parsefile.tell()
+            self._setoffsets(field, start)
             extra = {}
-            if issubclass(tp, (Array, Zlib)):
+            if issubclass(tp, (Array, LazyArray, Zlib)):
                 try:
                     extra = {'_init_common': self.init_common}
                 except AttributeError:
@@ -348,13 +602,15 @@ class Structure(metaclass=StructureMeta):
                 extra.update(hook(self))
             try:
                 val = tp((parsefile, self._maxfin), **extra)
+            except LimitExceeded:
+                raise
             except ValueError:
                 raise ParseError(f"{subcl.__name__} at offset {offset}: "
                                  f"invalid {tp.__name__} {field}")
-            self._actual_roffsets[field] = parsefile.tell()
+            self._setoffsets(field, start, parsefile.tell())
             try:
-                defval = getattr(cls, field)
-            except AttributeError:
+                defval = cls._defaults[field]
+            except KeyError:
                 pass
             else:
                 if defval != val:
@@ -375,7 +631,7 @@ class Structure(metaclass=StructureMeta):
                     break
         if retype and not issubclass(subcl, retype):
             return retype(self, parsefile=parsefile)
-        print(f"Parsed: {self!r}")
+        debug("Parsed: %r", self)
         self._fin = parsefile.tell()
         self._validate()
         return self
@@ -395,7 +651,7 @@ class Structure(metaclass=StructureMeta):
     def _fields(self):
         for key in self.__annotations_all__:
             val = getattr(self, key, None)
-            if val != getattr(type(self), key, None):
+            if val != self._defaults.get(key):
                 yield key, val
 
     def __repr__(self):
@@ -410,12 +666,11 @@ def get_base_type(tp, metaclass=StructureMeta):
     class BaseType(tp, Structure, metaclass=metaclass):
         @classmethod
         def __new__(cls, subcl, parseobj):
-            if isinstance(parseobj, tp):
-                val = parseobj
-            else:
-                parsefile, _ = cls._parsefile(parseobj)
+            if isinstance(parseobj, int):
+                return tp.__new__(subcl, parseobj)
+            parsefile, _ = cls._parsefile(parseobj)
             self = tp.__new__(subcl, cls._parse(parsefile))
-            print(f"Parsed: {self!r}")
+            debug("Parsed: %r", self)
             return self
 
         @classmethod
@@ -450,18 +705,45 @@ class EnumBaseTypeMeta(StructureMeta, EnumMeta):
     pass
 
 
-def BuildEnum(ft, cls):
-    return EnumBaseTypeMeta.from_struct(
-        ft._struct.format,
-        name=ft.__name__ + cls.__name__,
-        bases=get_base_type(cls, metaclass=EnumBaseTypeMeta))
+def BuildEnum(ft, cls, _enums={}):
+    try:
+        return _enums[ft, cls]
+    except KeyError:
+        pass
+    with _templates_lock:
+        try:
+            return _enums[ft, cls]
+        except KeyError:
+            pass
+        ret = EnumBaseTypeMeta.from_struct(
+            ft._struct.format,
+            name=ft.__name__ + cls.__name__,
+            bases=get_base_type(cls, metaclass=EnumBaseTypeMeta))
+        ret._recipe = BuildEnum, (ft, cls)
+        _enums[ft, cls] = ret
+        return ret
+
+
+copyreg.pickle(StructureMeta, _reduce_class)
+copyreg.pickle(EnumBaseTypeMeta, _reduce_class)
 
 
 class EfficientUInt63(UInt32):
-    @property
-    def _struct(self):
-        return Struct('I' if self < 0x80000000 else 'Q')
-    _rdstruct = Struct('i')
+    # 31 bits, or 63 bits if the top bit of the first word is set
+    _rdstruct = Struct('I')
+
+    @classmethod
+    def _parse(cls, parsefile):
+        val, = cls._rdstruct.unpack(parsefile.read(4))
+        if val & 0x80000000:
+            high, = cls._rdstruct.unpack(parsefile.read(4))
+            val = val & 0x7fffffff | high << 31
+        return val
+
+    def _tobytes(self):
+        if self < 0x80000000:
+            return self._rdstruct.pack(self)
+        return Struct('II').pack(self & 0x7fffffff | 0x80000000, self >> 31)
 
 
 class ZlibReader:
@@ -470,6 +752,10 @@ class ZlibReader:
         self._obj = zlib.decompressobj()
         self._off = 0
         self._readbuf = BytesIO()
+        self._progress = progress('zlib')
+        self._guard = limits()
+        if self._progress is not None or self._guard is not None:
+            self._start = fp.tell()
 
     def tell(self):
         return self._off
@@ -494,13 +780,23 @@ class ZlibReader:
                     ret += self._obj.flush()
                     break
                 ret += self._obj.decompress(rd)
+                if self._guard is not None:
+                    self._guard.produced(self._off + len(ret),
+                                         self._fp.tell() - self._start,
+                                         'zlib stream')
             self._readbuf = BytesIO(ret)
             ret = self._readbuf.read(n)
+            if self._progress is not None:
+                self._progress.update(self._fp.tell() - self._start,
+                                      self._off + len(ret))
         self._off += len(ret)
         return ret
 
     def close(self):
         self.read(1)
+        if self._progress is not None:
+            self._progress.update(self._fp.tell() - self._start, self._off)
+            self._progress.done()
 
 
 class Zlib(Structure):
@@ -512,20 +808,30 @@ class Zlib(Structure):
             raise TemplateNeeded(cls.__name__)
         parsefile, _ = cls._parsefile(parseobj)
         zreader = ZlibReader(parsefile)
-        ret = cls._tp(zreader, init_common=_init_common)
-        zreader.close()
+        with stage('zlib') as st:
+            start = parsefile.tell()
+            ret = cls._tp(zreader, init_common=_init_common)
+            zreader.close()
+            st.bytes_in = parsefile.tell() - start
+            st.bytes_out = zreader.tell()
         return ret
 
+    @classmethod
+    def _dump(cls, val):
+        return zlib.compress(cls._tp._dump(val))
+
 
 class Array(list, Structure):
     _template = '_tp',
 
     @classmethod
-    def __new__(cls, subcl, parseobj, _init_common=None, _maxcount=0x80000000,
-                _maxfin2=None):
+    def __new__(cls, subcl, parseobj=None, _init_common=None,
+                _maxcount=0x80000000, _maxfin2=None):
         if cls._template:
             raise TemplateNeeded(subcl.__name__)
         self = super().__new__(subcl)
+        if parseobj is None:
+            return self
         parsefile, self._maxfin = cls._parsefile(parseobj)
         if _maxfin2 is not None:
             self._maxfin = _maxfin2
@@ -545,9 +851,13 @@ class Array(list, Structure):
             else:
                 obj = self._tp(fileobj)
             self.append(obj)
-            print(f"element #{i}/{self._maxcount}")
+            debug("element #%d/%d", i, self._maxcount)
         return self
 
+    @classmethod
+    def _dump(cls, val):
+        return b''.join(cls._tp._dump(obj) for obj in val)
+
     def __repr__(self):
         if len(self) < 4:
             return super().__repr__()
@@ -557,13 +867,104 @@ class Array(list, Structure):
         return f"[{fieldrep}]"
 
 
+class LazyArray(Structure):
+    # Like Array, but only element offsets are found up front, by hopping
+    # over them with _tp._skip; elements are parsed when indexed, with the
+    # last few kept. Needs a seekable file that outlives the parse.
+    __slots__ = '_starts', '_init_common', '_cache', '_lock'
+    _template = '_tp',
+    _cachesize = 8
+
+    @classmethod
+    def __new__(cls, subcl, parseobj=None, _init_common=None,
+                _maxcount=0x80000000, _maxfin2=None):
+        if cls._template:
+            raise TemplateNeeded(subcl.__name__)
+        self = object.__new__(subcl)
+        self._starts = []
+        self._init_common = _init_common
+        self._cache = OrderedDict()
+        if parseobj is None:
+            return self
+        self._file, self._maxfin = cls._parsefile(parseobj)
+        if _maxfin2 is not None:
+            self._maxfin = _maxfin2
+        fileobj = self._file
+        self._lock = _filelock(fileobj)
+        while len(self._starts) < _maxcount:
+            if fileobj.tell() > self._maxfin - self._tp.ALIGNMENT:
+                break
+            self._starts.append(fileobj.tell())
+            self._tp._skip(fileobj)
+        return self
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(len(self))[idx]]
+        start = self._starts[idx]
+        with self._lock:
+            try:
+                self._cache.move_to_end(start)
+                return self._cache[start]
+            except KeyError:
+                pass
+            pos = self._file.tell()
+            self._file.seek(start)
+            try:
+                if self._init_common:
+                    obj = self._tp(self._file, init_common=self._init_common)
+                else:
+                    obj = self._tp(self._file)
+            finally:
+                self._file.seek(pos)
+            self._cache[start] = obj
+            if len(self._cache) > self._cachesize:
+                self._cache.popitem(last=False)
+            return obj
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reduce__(self):
+        # the file does not travel, and parsing every element to pickle
+        # them is what the laziness is there to avoid; util.treecodec
+        # keeps the offsets instead
+        raise TypeError(f"cannot pickle {type(self).__name__}, its "
+                        f"elements are read from the file it was parsed from")
+
+    @classmethod
+    def _dump(cls, val):
+        return b''.join(cls._tp._dump(obj) for obj in val)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} of {len(self)} {self._tp.__name__}>"
+
+
 class UTF16String(Structure):  # str
     def _parse(self, fileobj):
-        print(f"{self._maxfin=}, {fileobj.tell()=}")
+        debug("UTF-16 string from %d to %d", fileobj.tell(), self._maxfin)
+        guard = limits()
+        if guard is not None:
+            guard.declared(self._maxfin - fileobj.tell(), 'UTF-16 string')
         rd = fileobj.read(self._maxfin - fileobj.tell())
         return rd.decode('UTF-16')
 
+    @classmethod
+    def _dump(cls, val):
+        return val.encode('UTF-16-LE')
+
 
 class UnknownPayload(Structure):  # bytes
     def _parse(self, fileobj):
+        guard = limits()
+        if guard is not None:
+            guard.declared(self._maxfin - fileobj.tell(), 'payload')
         return fileobj.read(self._maxfin - fileobj.tell())
+
+    @classmethod
+    def _dump(cls, val):
+        return bytes(val)
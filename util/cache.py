@@ -0,0 +1,109 @@
+import hashlib
+import os
+import tempfile
+import zlib
+
+from util import treecodec
+
+
+# Bump whenever the shape of parsed trees changes (new fields, renamed
+# classes...), so that stale cache entries are never handed out.
+PARSER_VERSION = 4
+
+
+def filehash(fp):
+    pos = fp.tell()
+    fp.seek(0)
+    try:
+        return hashlib.file_digest(fp, 'sha256').hexdigest()
+    finally:
+        fp.seek(pos)
+
+
+class ParseCache:
+    # Parsed Structure trees, encoded by util.treecodec and zlib-compressed,
+    # one file per key. Entries are touched on every hit; the least
+    # recently used ones are evicted once the directory grows beyond
+    # max_size bytes.
+    #
+    # Lazy arrays are kept as offsets into the file parsed: for a
+    # SISContents that is the controller and where the data units are,
+    # never the file data, which is read from the file again when used.
+    def __init__(self, cache_dir, max_size=1 << 30, content_hash=False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.content_hash = content_hash
+
+    def key(self, fp, kind):
+        st = os.fstat(fp.fileno())
+        ident = [os.path.realpath(fp.name), st.st_size, st.st_mtime_ns,
+                 fp.tell(), kind, PARSER_VERSION]
+        if self.content_hash:
+            ident.append(filehash(fp))
+        return hashlib.sha256(repr(ident).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, source=None):
+        # source: the file parsed, for lazy arrays to read from
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                # only what gets used is decoded
+                ret = treecodec.loads(zlib.decompress(fp.read()), lazy=True,
+                                      fileobj=source)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # truncated or written by an incompatible version
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                # evicted or replaced by another process meanwhile
+                pass
+            return None
+        os.utime(path)
+        return ret
+
+    def put(self, key, obj):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        data = zlib.compress(treecodec.dumps(obj))
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+        with open(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def load(self, fp, kind, parse):
+        # parse(fp) unless an identical file was parsed before
+        try:
+            key = self.key(fp, kind)
+        except (AttributeError, OSError):
+            # not backed by a real file, nothing to identify it by
+            return parse(fp)
+        ret = self.get(key, fp)
+        if ret is None:
+            ret = parse(fp)
+            self.put(key, ret)
+        return ret
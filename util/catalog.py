@@ -0,0 +1,180 @@
+import json
+import sqlite3
+
+# SQLite catalog of scanned packages and images, filled by catalog.py from
+# scan.inventory records. Files are keyed by path and remember the size
+# and mtime they were scanned at; what was found in them is keyed by
+# their SHA-256, so that copies of one package are described once:
+#
+#   files             path -> size, mtime_ns, sha256
+#   contents          sha256 -> format, error, the whole record as JSON
+#   packages          SIS package UID, vendor, name, version, created
+#   package_files     what a package installs: target, size, SHA-1, index
+#   images            E32 image UIDs, secure and vendor ID
+#   image_caps        capability names of an image
+#   image_imports     (DLL base name, ordinal) pairs an image imports
+#
+# Targets are also kept as `tpath`, lowercase and without the drive, since
+# packages install to 'c:', '!:' or wherever the user picks.
+
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE files (
+    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT);
+CREATE INDEX files_sha256 ON files (sha256);
+CREATE TABLE contents (
+    sha256 TEXT PRIMARY KEY, format TEXT, error TEXT, record TEXT);
+CREATE TABLE packages (
+    sha256 TEXT PRIMARY KEY, uid INTEGER, vendor TEXT, name TEXT,
+    version TEXT, created TEXT);
+CREATE INDEX packages_uid ON packages (uid);
+CREATE TABLE package_files (
+    sha256 TEXT, target TEXT, tpath TEXT, size INTEGER, sha1 TEXT,
+    file_index INTEGER);
+CREATE INDEX package_files_sha256 ON package_files (sha256);
+CREATE INDEX package_files_tpath ON package_files (tpath);
+CREATE INDEX package_files_sha1 ON package_files (sha1);
+CREATE TABLE images (
+    sha256 TEXT PRIMARY KEY, uid1 INTEGER, uid2 INTEGER, uid3 INTEGER,
+    secure_id INTEGER, vendor_id INTEGER);
+CREATE INDEX images_uid3 ON images (uid3);
+CREATE TABLE image_caps (sha256 TEXT, capability TEXT);
+CREATE INDEX image_caps_sha256 ON image_caps (sha256);
+CREATE INDEX image_caps_capability ON image_caps (capability COLLATE NOCASE);
+CREATE TABLE image_imports (sha256 TEXT, dll TEXT, ordinal INTEGER);
+CREATE INDEX image_imports_sha256 ON image_imports (sha256);
+CREATE INDEX image_imports_dll ON image_imports (dll, ordinal);
+'''
+
+# content tables, cleaned up by sha256
+_CONTENT_TABLES = ('contents', 'packages', 'package_files', 'images',
+                   'image_caps', 'image_imports')
+
+
+def target_path(target):
+    # 'C:\\sys\\bin\\Foo.dll' -> '\\sys\\bin\\foo.dll'
+    return target.rpartition(':')[2].lower()
+
+
+class Catalog:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        version, = self.db.execute('PRAGMA user_version').fetchone()
+        if version != SCHEMA_VERSION:
+            # a catalog is only ever a cache of the scanned files
+            with self.db:
+                for name, in self.db.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'table'"
+                        ).fetchall():
+                    self.db.execute(f'DROP TABLE {name}')
+                self.db.executescript(SCHEMA)
+                self.db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def files(self):
+        # path -> (size, mtime_ns, sha256)
+        return {path: rest for path, *rest in self.db.execute(
+            'SELECT path, size, mtime_ns, sha256 FROM files')}
+
+    def known(self, sha256):
+        return self.db.execute('SELECT 1 FROM contents WHERE sha256 = ?',
+                               (sha256,)).fetchone() is not None
+
+    def set_file(self, path, size, mtime_ns, sha256):
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                        (path, size, mtime_ns, sha256))
+
+    def remove_file(self, path):
+        self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def add(self, sha256, rec):
+        # rec: a scan.inventory record
+        db = self.db
+        fmt = rec.get('format')
+        db.execute('INSERT OR REPLACE INTO contents VALUES (?, ?, ?, ?)',
+                   (sha256, fmt, rec.get('error'),
+                    json.dumps(rec, ensure_ascii=False)))
+        if 'error' in rec:
+            return
+        if fmt == 'sis':
+            db.execute('INSERT OR REPLACE INTO packages VALUES '
+                       '(?, ?, ?, ?, ?, ?)',
+                       (sha256, rec['uid'], rec['vendor'],
+                        rec['names'][0] if rec['names'] else None,
+                        '.'.join(map(str, rec['version'])), rec['created']))
+            db.executemany('INSERT INTO package_files VALUES '
+                           '(?, ?, ?, ?, ?, ?)',
+                           [(sha256, f['target'], target_path(f['target']),
+                             f['size'], f['sha1'], f['index'])
+                            for f in rec['files']])
+        elif fmt == 'e32':
+            db.execute('INSERT OR REPLACE INTO images VALUES '
+                       '(?, ?, ?, ?, ?, ?)',
+                       (sha256, *rec['uids'], rec['secure_id'],
+                        rec['vendor_id']))
+            db.executemany('INSERT INTO image_caps VALUES (?, ?)',
+                           [(sha256, cap) for cap in rec['capabilities']])
+            from e32exe import dllbasename
+            db.executemany('INSERT INTO image_imports VALUES (?, ?, ?)',
+                           [(sha256, dllbasename(dll), ordinal)
+                            for dll, ordinals in rec.get('imports', {}).items()
+                            for ordinal in ordinals])
+
+    def prune(self):
+        # forget contents no file has any more
+        for table in _CONTENT_TABLES:
+            self.db.execute(f'DELETE FROM {table} WHERE sha256 NOT IN '
+                            '(SELECT sha256 FROM files)')
+
+    def installing(self, target):
+        # (package path, target) of packages installing target, with or
+        # without a drive
+        return self.db.execute(
+            'SELECT files.path, package_files.target FROM package_files '
+            'JOIN files USING (sha256) WHERE tpath = ? ORDER BY files.path',
+            (target_path(target),)).fetchall()
+
+    def with_capability(self, capability):
+        return [path for path, in self.db.execute(
+            'SELECT files.path FROM image_caps JOIN files USING (sha256) '
+            'WHERE capability = ? COLLATE NOCASE ORDER BY files.path',
+            (capability,))]
+
+    def importing(self, dll, ordinal=None):
+        # paths of images importing from dll, a given ordinal if not None
+        dll = dll.split('.')[0].lower()
+        if ordinal is None:
+            cur = self.db.execute(
+                'SELECT DISTINCT files.path FROM image_imports '
+                'JOIN files USING (sha256) WHERE dll = ? ORDER BY files.path',
+                (dll,))
+        else:
+            cur = self.db.execute(
+                'SELECT DISTINCT files.path FROM image_imports '
+                'JOIN files USING (sha256) WHERE dll = ? AND ordinal = ? '
+                'ORDER BY files.path', (dll, ordinal))
+        return [path for path, in cur]
+
+    def by_uid(self, uid):
+        # paths of packages with this UID and images with this UID3
+        return [path for path, in self.db.execute(
+            'SELECT files.path FROM files WHERE sha256 IN '
+            '(SELECT sha256 FROM packages WHERE uid = ? UNION '
+            'SELECT sha256 FROM images WHERE uid3 = ?) ORDER BY files.path',
+            (uid, uid))]
+
+    def record(self, path):
+        row = self.db.execute(
+            'SELECT record FROM contents JOIN files USING (sha256) '
+            'WHERE path = ?', (path,)).fetchone()
+        return row and json.loads(row[0])
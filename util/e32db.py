@@ -0,0 +1,130 @@
+import mmap
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from struct import Struct
+
+# On-disk symbol database generated by gen-e32def.py, all little-endian:
+#
+#   header   magic, number of DLLs, strings and ordinal slots
+#   dlls     (name string index, first ordinal slot, ordinal count)
+#            for every DLL, sorted by name
+#   strofs   nstrings + 1 offsets into the string data
+#   ordinals string index of each symbol, DLL after DLL
+#   strings  UTF-8 names, sorted and deduplicated
+#
+# Nothing is read up front: the file is mmap'ed, so lookups only touch
+# the pages of the DLLs that are actually imported from.
+
+MAGIC = b'E32DEF\0\1'
+HEADER = Struct('<8sIII')
+DLL = Struct('<III')
+U32 = Struct('<I')
+SPAN = Struct('<II')
+
+
+class Ordinals(Sequence):
+    def __init__(self, db, start, count):
+        self._db = db
+        self._start = start
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < self._count:
+            raise IndexError(idx)
+        return self._db._string(U32.unpack_from(
+            self._db._mm, self._db._ordofs + 4 * (self._start + idx))[0])
+
+
+class E32Def(Mapping):
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._ndlls, nstrings, nords = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not an e32def database")
+        self._dllofs = HEADER.size
+        self._strofs = self._dllofs + DLL.size * self._ndlls
+        self._ordofs = self._strofs + 4 * (nstrings + 1)
+        self._strdata = self._ordofs + 4 * nords
+        self._names = None
+
+    def _string(self, idx):
+        start, end = SPAN.unpack_from(self._mm, self._strofs + 4 * idx)
+        return str(self._mm[self._strdata + start:self._strdata + end],
+                   'utf-8')
+
+    def _dll(self, idx):
+        return DLL.unpack_from(self._mm, self._dllofs + DLL.size * idx)
+
+    @property
+    def names(self):
+        # sorted DLL names, decoded on first use
+        if self._names is None:
+            self._names = [self._string(self._dll(i)[0])
+                           for i in range(self._ndlls)]
+        return self._names
+
+    def first_prefixed(self, prefix):
+        # the first DLL, in sorted order, whose name starts with prefix
+        names = self.names
+        idx = bisect_left(names, prefix)
+        if idx < len(names) and names[idx].startswith(prefix):
+            return names[idx]
+        return None
+
+    def __len__(self):
+        return self._ndlls
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, name):
+        names = self.names
+        idx = bisect_left(names, name)
+        if idx == len(names) or names[idx] != name:
+            raise KeyError(name)
+        _, start, count = self._dll(idx)
+        return Ordinals(self, start, count)
+
+    def close(self):
+        self._mm.close()
+
+
+def parse_def(fn):
+    # ordinal -> symbol name, as exported by one .def file
+    d = {}
+    with open(fn) as f:
+        for line in f:
+            fields = line.strip().split('@')
+            if len(fields) >= 2:
+                sym, num = fields
+                num = num.split()[0]
+                d[int(num)] = sym.strip()
+    return d
+
+
+def write_e32def(fp, deffiles):
+    strings = sorted({s for syms in deffiles.values() for s in syms}
+                     | set(deffiles))
+    stridx = {s: i for i, s in enumerate(strings)}
+    encoded = [s.encode('utf-8') for s in strings]
+
+    dlls = []
+    ordinals = []
+    for name in sorted(deffiles):
+        syms = deffiles[name]
+        dlls.append(DLL.pack(stridx[name], len(ordinals), len(syms)))
+        ordinals.extend(stridx[s] for s in syms)
+
+    fp.write(HEADER.pack(MAGIC, len(dlls), len(strings), len(ordinals)))
+    fp.writelines(dlls)
+    off = 0
+    for s in encoded:
+        fp.write(U32.pack(off))
+        off += len(s)
+    fp.write(U32.pack(off))
+    fp.write(Struct(f'<{len(ordinals)}I').pack(*ordinals))
+    fp.writelines(encoded)
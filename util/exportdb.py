@@ -0,0 +1,127 @@
+import mmap
+from bisect import bisect_left
+from collections import namedtuple
+from struct import Struct
+
+# On-disk export index written by index-exports.py, all little-endian:
+#
+#   header   magic, number of images, exports, symbols and strings
+#   images   (iUid3, name string index, path string index) for every image
+#   exports  (name string index, ordinal, image index, code offset, symbol
+#            string index or NOSYMBOL), sorted by name and ordinal
+#   bysym    indices of the exports with a symbol, sorted by symbol
+#   strofs   nstrings + 1 offsets into the string data
+#   strings  UTF-8 image names, paths and symbols, sorted and deduplicated
+#
+# Like util.e32db, the file is mmap'ed and lookups bisect it in place.
+
+MAGIC = b'E32EXP\0\1'
+HEADER = Struct('<8sIIII')
+IMAGE = Struct('<III')
+EXPORT = Struct('<IIIiI')
+U32 = Struct('<I')
+SPAN = Struct('<II')
+NOSYMBOL = 0xffffffff
+
+# name is the image file name without extension, lowercase, like the
+# DLL names of the symbol database; offset is from the code section start
+Export = namedtuple('Export', 'uid name ordinal offset symbol path')
+
+
+class ExportIndex:
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, nimages, self._nexports, self._nsyms,
+         self._nstrings) = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not an export index")
+        self._imgofs = HEADER.size
+        self._expofs = self._imgofs + IMAGE.size * nimages
+        self._symofs = self._expofs + EXPORT.size * self._nexports
+        self._strofs = self._symofs + 4 * self._nsyms
+        self._strdata = self._strofs + 4 * (self._nstrings + 1)
+
+    def _string(self, idx):
+        start, end = SPAN.unpack_from(self._mm, self._strofs + 4 * idx)
+        return str(self._mm[self._strdata + start:self._strdata + end],
+                   'utf-8')
+
+    def _find(self, s):
+        idx = bisect_left(range(self._nstrings), s, key=self._string)
+        if idx < self._nstrings and self._string(idx) == s:
+            return idx
+        return None
+
+    def _export(self, idx):
+        return EXPORT.unpack_from(self._mm, self._expofs + EXPORT.size * idx)
+
+    def _make(self, idx):
+        name, ordinal, image, offset, sym = self._export(idx)
+        uid, _, path = IMAGE.unpack_from(self._mm,
+                                         self._imgofs + IMAGE.size * image)
+        return Export(uid, self._string(name), ordinal, offset,
+                      None if sym == NOSYMBOL else self._string(sym),
+                      self._string(path))
+
+    def __len__(self):
+        return self._nexports
+
+    def by_ordinal(self, name, ordinal=None):
+        # exports of every image called name, only ordinal if given
+        strid = self._find(name.lower())
+        if strid is None:
+            return []
+        key = lambda i: self._export(i)[:2]
+        lo = bisect_left(range(self._nexports), (strid, ordinal or 0),
+                         key=key)
+        hi = bisect_left(range(self._nexports),
+                         (strid, 1 << 32 if ordinal is None else ordinal + 1),
+                         key=key, lo=lo)
+        return [self._make(i) for i in range(lo, hi)]
+
+    def by_symbol(self, symbol):
+        strid = self._find(symbol)
+        if strid is None:
+            return []
+        bysym = lambda i: U32.unpack_from(self._mm, self._symofs + 4 * i)[0]
+        key = lambda i: self._export(bysym(i))[4]
+        lo = bisect_left(range(self._nsyms), strid, key=key)
+        hi = bisect_left(range(self._nsyms), strid + 1, key=key, lo=lo)
+        return [self._make(bysym(i)) for i in range(lo, hi)]
+
+    def close(self):
+        self._mm.close()
+
+
+def write_exportdb(fp, images):
+    # images: (iUid3, name, path, [(ordinal, code offset, symbol)...])
+    strings = set()
+    for _, name, path, exports in images:
+        strings.update((name, path))
+        strings.update(sym for _, _, sym in exports if sym is not None)
+    strings = sorted(strings)
+    stridx = {s: i for i, s in enumerate(strings)}
+    encoded = [s.encode('utf-8') for s in strings]
+
+    rows = []
+    for i, (_, name, _, exports) in enumerate(images):
+        for ordinal, offset, sym in exports:
+            rows.append((stridx[name], ordinal, i, offset,
+                         NOSYMBOL if sym is None else stridx[sym]))
+    rows.sort()
+    bysym = sorted((row[4], i) for i, row in enumerate(rows)
+                   if row[4] != NOSYMBOL)
+
+    fp.write(HEADER.pack(MAGIC, len(images), len(rows), len(bysym),
+                         len(strings)))
+    fp.writelines(IMAGE.pack(uid, stridx[name], stridx[path])
+                  for uid, name, path, _ in images)
+    fp.writelines(EXPORT.pack(*row) for row in rows)
+    fp.write(Struct(f'<{len(bysym)}I').pack(*(i for _, i in bysym)))
+    off = 0
+    for s in encoded:
+        fp.write(U32.pack(off))
+        off += len(s)
+    fp.write(U32.pack(off))
+    fp.writelines(encoded)
@@ -0,0 +1,126 @@
+import threading
+import time
+from contextvars import ContextVar
+
+# Budgets for parsing untrusted input. While a Limits is active
+#
+#   with Limits(max_output=256 << 20, max_ratio=100, max_seconds=30):
+#       parse_contents(fp)
+#
+# the decoders check the lengths they are told, the bytes they produce
+# and the clock as they go, and give up with a LimitExceeded (a
+# ParseError) instead of allocating or spinning without end. Unset
+# budgets are not checked; with no Limits active, all decoders pay is an
+# `is None` check, as for util.profile and util.progress.
+#
+#   max_output   bytes any one payload, string or image may decode to
+#   max_ratio    decoded bytes per compressed byte; outputs of up to
+#                RATIO_SLACK bytes are let through whatever their ratio
+#   max_depth    how deeply parsed structures may nest
+#   max_seconds  wall time from when the Limits was entered
+#
+# A Limits is active in the thread (or asyncio task) that entered it, and
+# only there: workers of a pool each enter their own, or the same one,
+# for every file they take on. Entering nests; leaving brings back what
+# was active before.
+
+RATIO_SLACK = 1 << 20
+
+# output bytes between clock checks in a tight decoding loop
+STEP = 1 << 12
+
+_active = ContextVar('limits', default=None)
+
+
+def _fail(msg):
+    from util.binfile import LimitExceeded
+    raise LimitExceeded(msg)
+
+
+class Limits:
+    def __init__(self, max_output=None, max_ratio=None, max_depth=None,
+                 max_seconds=None):
+        self.max_output = max_output
+        self.max_ratio = max_ratio
+        self.max_depth = max_depth
+        self.max_seconds = max_seconds
+        # per thread: depth, deadline, and what to go back to on stop
+        self._local = threading.local()
+
+    def start(self):
+        local = self._local
+        if not hasattr(local, 'saved'):
+            local.saved = []
+            local.deadline = None
+        local.saved.append((_active.set(self), local.deadline))
+        if self.max_seconds is not None:
+            local.deadline = time.monotonic() + self.max_seconds
+        return self
+
+    def stop(self):
+        token, self._local.deadline = self._local.saved.pop()
+        _active.reset(token)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def declared(self, size, what):
+        # a length read from the input, before anything that size is made
+        if self.max_output is not None and size > self.max_output:
+            _fail(f"{what}: {size} bytes, more than the "
+                  f"{self.max_output} allowed")
+
+    def clock(self, what):
+        deadline = getattr(self._local, 'deadline', None)
+        if deadline is not None and time.monotonic() > deadline:
+            _fail(f"{what}: over the {self.max_seconds} s allowed")
+
+    def produced(self, size, consumed, what):
+        # size bytes decoded from consumed so far
+        self.declared(size, what)
+        if self.max_ratio is not None and size > RATIO_SLACK \
+                and size > consumed * self.max_ratio:
+            _fail(f"{what}: {size} bytes from {consumed}, more than "
+                  f"{self.max_ratio} times as many")
+        self.clock(what)
+
+    def enter(self, what):
+        # a structure starts; leave() once it is done, unless this raised
+        self.clock(what)
+        depth = getattr(self._local, 'depth', 0) + 1
+        if self.max_depth is not None and depth > self.max_depth:
+            _fail(f"{what}: nested more than {self.max_depth} deep")
+        self._local.depth = depth
+
+    def leave(self):
+        self._local.depth -= 1
+
+
+def limits():
+    # the Limits active here, None if there is none
+    return _active.get()
+
+
+def add_arguments(par):
+    par.add_argument('--max-output', type=int, metavar='BYTES',
+                     help="Give up on payloads, strings or images larger "
+                     "than this")
+    par.add_argument('--max-ratio', type=float,
+                     help="Give up on data compressed more than this many "
+                     f"times (over {RATIO_SLACK >> 20} MiB)")
+    par.add_argument('--max-depth', type=int,
+                     help="Give up on structures nested deeper than this")
+    par.add_argument('--timeout', type=float, metavar='SECONDS',
+                     help="Give up on a file after this long")
+
+
+def from_args(arg):
+    # keyword arguments of Limits from add_arguments options, None if none
+    kw = dict(max_output=arg.max_output, max_ratio=arg.max_ratio,
+              max_depth=arg.max_depth, max_seconds=arg.timeout)
+    if all(v is None for v in kw.values()):
+        return None
+    return kw
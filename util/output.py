@@ -0,0 +1,296 @@
+import errno
+import os
+import threading
+
+
+FICLONE = 0x40049409  # linux/fs.h
+
+
+def _chunks(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data,
+    return data
+
+
+class DirectoryOutput:
+    # plain loose files in target_dir, one fresh copy per extracted file
+    def __init__(self, target_dir):
+        self.target_dir = target_dir
+
+    def path(self, name):
+        return os.path.join(self.target_dir, name)
+
+    def add(self, name, data, size=None):
+        # data: bytes, or an iterable of chunks; size, if known, of all
+        # of it (unused here, archives want it up front)
+        dest = self.path(name)
+        if os.path.lexists(dest):
+            # may be a hardlink into a ContentStore, never write through it
+            os.unlink(dest)
+        with open(dest, 'wb') as ofp:
+            for chunk in _chunks(data):
+                ofp.write(chunk)
+
+
+class ContentStore(DirectoryOutput):
+    # Every unique payload is stored once as store_dir/ab/cdef... (its hex
+    # digest) and linked into target_dir under the extracted name.
+    def __init__(self, store_dir, target_dir, link='hard', algorithm='sha256'):
+        if link not in ('hard', 'reflink', 'copy'):
+            raise ValueError(f"unknown link type: {link!r}")
+        super().__init__(target_dir)
+        self.store_dir = store_dir
+        self.link = link
+        self.algorithm = algorithm
+        self.stored = 0  # bytes actually written to the store
+        self.deduplicated = 0  # bytes found already in the store
+        # add() may be called from several threads
+        self._lock = threading.Lock()
+
+    def _count(self, stored=0, deduplicated=0):
+        with self._lock:
+            self.stored += stored
+            self.deduplicated += deduplicated
+
+    def blobpath(self, digest):
+        return os.path.join(self.store_dir, digest[:2], digest[2:])
+
+    def add(self, name, data, size=None):
+        # imported here, plain extraction should not pay for them at startup
+        import hashlib
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            # digest known up front: skip the write entirely if stored
+            blob = self.blobpath(hashlib.new(self.algorithm, data).hexdigest())
+            if os.path.exists(blob):
+                self._count(deduplicated=len(data))
+            else:
+                self._store((data,), blob)
+        else:
+            blob = self._store(data)
+        self._link(blob, self.path(name))
+        return blob
+
+    def _store(self, chunks, blob=None):
+        import hashlib
+        import tempfile
+        os.makedirs(self.store_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.store_dir, prefix='.tmp')
+        try:
+            h = hashlib.new(self.algorithm)
+            size = 0
+            with open(fd, 'wb') as ofp:
+                for chunk in chunks:
+                    h.update(chunk)
+                    ofp.write(chunk)
+                    size += len(chunk)
+            if blob is None:
+                blob = self.blobpath(h.hexdigest())
+            if os.path.exists(blob):
+                self._count(deduplicated=size)
+                os.unlink(tmp)
+                return blob
+            # blobs are shared by every tree linking them, keep them intact
+            os.chmod(tmp, 0o444)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(tmp, blob)
+            self._count(stored=size)
+            return blob
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def _link(self, blob, dest):
+        import fcntl
+        import shutil
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        if self.link == 'hard':
+            try:
+                return os.link(blob, dest)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        elif self.link == 'reflink':
+            with open(blob, 'rb') as src, open(dest, 'wb') as dst:
+                try:
+                    return fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EOPNOTSUPP,
+                                       errno.EINVAL, errno.ENOTTY):
+                        raise
+        # cross-device, or no reflink support in the filesystem
+        shutil.copyfile(blob, dest)
+
+
+def atomic_write(path, write):
+    import tempfile
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix='.' + os.path.basename(path))
+    umask = os.umask(0)
+    os.umask(umask)
+    try:
+        with open(fd, 'wb') as fp:
+            write(fp)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class _ChunkReader:
+    # read() over an iterable of chunks, as tarfile wants a file
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._cur = memoryview(b'')
+
+    def read(self, n=-1):
+        parts = []
+        while n:
+            if not self._cur:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._cur = memoryview(chunk)
+                continue
+            part = self._cur if n < 0 else self._cur[:n]
+            self._cur = self._cur[len(part):]
+            parts.append(part)
+            if n > 0:
+                n -= len(part)
+        return b''.join(parts)
+
+
+class ArchiveOutput:
+    # One archive instead of a directory, written front to back so that
+    # fp may be a pipe. Files are streamed into it as they are
+    # decompressed. Nothing is left on disk to run tools in, hence no
+    # target_dir.
+    target_dir = None
+
+    def __init__(self, fp, closefp=False):
+        import time
+        self.fp = fp
+        self.closefp = closefp
+        self.mtime = int(time.time())
+        # add() may be called from several threads, one member at a time
+        self._lock = threading.Lock()
+
+    def add(self, name, data, size=None):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            size = len(data)
+            data = _chunks(data)
+        elif size is None:
+            # the size goes first in a member header
+            data = b''.join(data)
+            size = len(data)
+            data = data,
+        with self._lock:
+            self._add(name, data, size)
+
+    def close(self):
+        if self.closefp:
+            self.fp.close()
+        else:
+            self.fp.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TarOutput(ArchiveOutput):
+    # compression: None, 'gz' or 'zst' (the latter from Python 3.14 on)
+    def __init__(self, fp, compression=None, closefp=False):
+        import tarfile
+        super().__init__(fp, closefp)
+        mode = f'w|{compression}' if compression else 'w|'
+        try:
+            self._tar = tarfile.open(fileobj=fp, mode=mode,
+                                     format=tarfile.PAX_FORMAT)
+        except tarfile.CompressionError as e:
+            raise ValueError(f"cannot write {compression} compressed tar "
+                             f"archives with this Python: {e}") from None
+
+    def _add(self, name, chunks, size):
+        import tarfile
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = self.mtime
+        info.mode = 0o644
+        self._tar.addfile(info, _ChunkReader(chunks))
+
+    def close(self):
+        self._tar.close()
+        super().close()
+
+
+class ZipOutput(ArchiveOutput):
+    def __init__(self, fp, compression=None, closefp=False):
+        import zipfile
+        super().__init__(fp, closefp)
+        if compression is None:
+            compression = zipfile.ZIP_DEFLATED
+        self._compression = compression
+        self._zip = zipfile.ZipFile(fp, 'w', compression)
+
+    def _add(self, name, chunks, size):
+        import time
+        import zipfile
+        info = zipfile.ZipInfo(name, time.localtime(self.mtime)[:6])
+        info.compress_type = self._compression
+        # known up front, zipfile decides on zip64 by it
+        info.file_size = size
+        with self._zip.open(info, 'w') as dst:
+            for chunk in chunks:
+                dst.write(chunk)
+
+    def close(self):
+        self._zip.close()
+        super().close()
+
+
+# suffix -> backend, compression
+ARCHIVES = {
+    '.tar': (TarOutput, None),
+    '.tar.gz': (TarOutput, 'gz'),
+    '.tgz': (TarOutput, 'gz'),
+    '.tar.zst': (TarOutput, 'zst'),
+    '.zip': (ZipOutput, None),
+}
+
+
+def archive_format(path):
+    # the ARCHIVES suffix path ends with, None if none
+    for suffix in sorted(ARCHIVES, key=len, reverse=True):
+        if path.lower().endswith(suffix):
+            return suffix
+    return None
+
+
+def open_archive(path, fmt=None):
+    # an ArchiveOutput writing to path ('-' for stdout), in the format
+    # given as an ARCHIVES suffix or else guessed from path
+    import sys
+    fmt = fmt or archive_format(path)
+    if fmt not in ARCHIVES:
+        raise ValueError(f"unknown archive format for {path!r}: {fmt!r}")
+    backend, compression = ARCHIVES[fmt]
+    if path == '-':
+        return backend(sys.stdout.buffer, compression)
+    fp = open(path, 'wb')
+    try:
+        return backend(fp, compression, closefp=True)
+    except BaseException:
+        fp.close()
+        os.unlink(path)
+        raise
+
+
+def get_output(target):
+    if isinstance(target, (str, bytes, os.PathLike)):
+        return DirectoryOutput(target)
+    return target
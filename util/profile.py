@@ -0,0 +1,174 @@
+import os
+import sys
+import threading
+import time
+
+# Named stages, for finding out where a run went. Library code marks
+# them with
+#
+#   with stage('zlib', len(compressed)) as st:
+#       data = decompress(compressed)
+#       st.bytes_out = len(data)
+#
+# which costs next to nothing unless a Profiler is active: then each one
+# records wall and CPU time (subprocesses included), bytes in and out,
+# and the peak tracemalloc'ed memory above where it started. Stages nest.
+
+_active = None  # the running Profiler
+
+
+class _NullStage:
+    # stands in for every stage while nothing is profiled
+    bytes_in = bytes_out = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL = _NullStage()
+
+
+def _cpu():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class Stage:
+    __slots__ = ('name', 'bytes_in', 'bytes_out', 'start', 'wall', 'cpu',
+                 'peak', 'tid', '_prof', '_cpu', '_mem', '_childpeak')
+
+    def __init__(self, prof, name, bytes_in=0):
+        self._prof = prof
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self.peak = 0
+        self._childpeak = 0
+
+    def __enter__(self):
+        prof = self._prof
+        self.tid = threading.get_ident()
+        prof._stack().append(self)
+        if prof.memory:
+            import tracemalloc
+            self._mem, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        self._cpu = _cpu()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.start
+        self.cpu = _cpu() - self._cpu
+        prof = self._prof
+        stack = prof._stack()
+        stack.pop()
+        if prof.memory:
+            import tracemalloc
+            # a nested stage resets the peak, the max of theirs is kept
+            peak = max(tracemalloc.get_traced_memory()[1], self._childpeak)
+            self.peak = max(peak - self._mem, 0)
+            if stack:
+                stack[-1]._childpeak = max(stack[-1]._childpeak, peak)
+        prof._record(self)
+
+
+def stage(name, bytes_in=0):
+    prof = _active
+    if prof is None:
+        return _NULL
+    return Stage(prof, name, bytes_in)
+
+
+class Profiler:
+    # Collects stages while started, optionally also under cProfile
+    # (pstats: where to dump its stats) and tracemalloc (memory).
+    def __init__(self, memory=True, pstats=None):
+        self.memory = memory
+        self.pstats = pstats
+        self.stages = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cprofile = None
+        self._origin = None
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _record(self, st):
+        with self._lock:
+            self.stages.append(st)
+
+    def start(self):
+        global _active
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.pstats:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._origin = time.perf_counter()
+        _active = self
+        return self
+
+    def stop(self):
+        global _active
+        _active = None
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.pstats)
+        if self.memory:
+            import tracemalloc
+            tracemalloc.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def summary(self):
+        # name -> [count, wall, cpu, bytes in, bytes out, peak memory],
+        # in order of first appearance
+        ret = {}
+        for st in sorted(self.stages, key=lambda st: st.start):
+            row = ret.setdefault(st.name, [0, 0.0, 0.0, 0, 0, 0])
+            row[0] += 1
+            row[1] += st.wall
+            row[2] += st.cpu
+            row[3] += st.bytes_in
+            row[4] += st.bytes_out
+            row[5] = max(row[5], st.peak)
+        return ret
+
+    def report(self, file=None):
+        file = file or sys.stderr
+        print(f"{'stage':<16} {'count':>6} {'wall s':>9} {'cpu s':>9} "
+              f"{'bytes in':>12} {'bytes out':>12} {'peak KiB':>10}",
+              file=file)
+        for name, (count, wall, cpu, bin_, bout, peak) in \
+                self.summary().items():
+            print(f"{name:<16} {count:>6} {wall:>9.4f} {cpu:>9.4f} "
+                  f"{bin_:>12} {bout:>12} {peak >> 10:>10}", file=file)
+
+    def write_trace(self, fp):
+        # Chrome trace event format, for chrome://tracing or Perfetto
+        import json
+        events = [{
+            'name': st.name, 'ph': 'X', 'pid': os.getpid(), 'tid': st.tid,
+            'ts': (st.start - self._origin) * 1e6, 'dur': st.wall * 1e6,
+            'args': {'cpu_s': st.cpu, 'bytes_in': st.bytes_in,
+                     'bytes_out': st.bytes_out, 'peak_bytes': st.peak},
+        } for st in self.stages]
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+
+# Progress of long decompressions and extractions. Register a callback
+#
+#   set_progress(lambda name, consumed, produced, elapsed, total: ...)
+#
+# and the decoders call it with the bytes they consumed and produced so
+# far, the seconds since they started and the bytes to consume if known,
+# at most every interval seconds and once more when done. Decoders ask
+# progress() for a tracker as they start: None when nothing is
+# registered, so that all they pay then is an `is None` check.
+
+_callback = None
+_interval = 0.25
+
+# output bytes between reports from a tight decoding loop
+STEP = 1 << 16
+
+
+def set_progress(callback, interval=0.25):
+    # callback None turns reporting off again
+    global _callback, _interval
+    _callback = callback
+    _interval = interval
+
+
+class Progress:
+    __slots__ = ('name', 'total', 'consumed', 'produced', 'start', '_next',
+                 '_callback', '_interval')
+
+    def __init__(self, name, total, callback, interval):
+        self.name = name
+        self.total = total
+        self.consumed = self.produced = 0
+        self._callback = callback
+        self._interval = interval
+        self.start = time.monotonic()
+        self._next = self.start + interval
+
+    def update(self, consumed, produced):
+        self.consumed = consumed
+        self.produced = produced
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self._interval
+            self._callback(self.name, consumed, produced, now - self.start,
+                           self.total)
+
+    def done(self):
+        self._callback(self.name, self.consumed, self.produced,
+                       time.monotonic() - self.start, self.total)
+
+
+def progress(name, total=None):
+    callback = _callback
+    if callback is None:
+        return None
+    return Progress(name, total, callback, _interval)
+
+
+def source_size(fp):
+    # size of the file behind fp, None if there is no such thing
+    try:
+        return os.fstat(fp.fileno()).st_size
+    except (AttributeError, OSError):
+        return None
+
+
+class ProgressBar:
+    # The CLI one: a line on a terminal, redrawn in place
+    def __init__(self, file=None, width=30):
+        self.file = file or sys.stderr
+        self.width = width
+        self._shown = False
+
+    def __call__(self, name, consumed, produced, elapsed, total):
+        rate = produced / elapsed / 1e6 if elapsed else 0
+        if total:
+            frac = min(consumed / total, 1)
+            fill = round(frac * self.width)
+            bar = f"[{'#' * fill}{'.' * (self.width - fill)}] {frac:4.0%}"
+        else:
+            bar = f"{consumed >> 10} KiB in"
+        self.file.write(f"\r{name:<8} {bar} {produced >> 10} KiB out, "
+                        f"{rate:.1f} MB/s, {elapsed:.1f} s\x1b[K")
+        self.file.flush()
+        self._shown = True
+
+    def close(self):
+        if self._shown:
+            self.file.write('\n')
+            self._shown = False
@@ -0,0 +1,85 @@
+import io
+
+
+class ForwardReader:
+    # File-like view of a stream that cannot seek (a pipe, stdin, a
+    # socket). The last `window` bytes read are kept, so that seeking back
+    # a little (peeking a byte, probing a header again from offset 0)
+    # still works; seeking forward reads and discards. tell() is the
+    # logical offset from the start of the stream.
+    def __init__(self, raw, window=1 << 16):
+        self._raw = raw
+        self._window = window
+        self._buf = bytearray()  # stream contents from _base on
+        self._base = 0
+        self._end = 0  # offset of what _raw reads next
+        self._pos = 0
+
+    def _trim(self):
+        # past a forward seek, _pos - window may be beyond what was read
+        drop = min(self._pos - self._window - self._base, len(self._buf))
+        if drop > 0:
+            del self._buf[:drop]
+            self._base += drop
+
+    def _fill(self, end=None):
+        # buffer up to offset end (everything if None); False on EOF
+        while end is None or self._end < end:
+            # a window at a time: a long skip forward is read and thrown
+            # away piecewise, never held whole
+            want = self._window
+            if end is not None:
+                want = max(min(end - self._end, want), 8192)
+            chunk = self._raw.read(want)
+            if not chunk:
+                return False
+            self._buf += chunk
+            self._end += len(chunk)
+            # skipping forward: what is behind the window is not kept
+            self._trim()
+        return True
+
+    def read(self, n=-1):
+        end = None if n is None or n < 0 else self._pos + n
+        self._fill(end)
+        start = self._pos - self._base
+        stop = len(self._buf) if end is None else end - self._base
+        data = bytes(self._buf[start:stop])
+        self._pos += len(data)
+        self._trim()
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def peek(self, n=1):
+        self._fill(self._pos + n)
+        start = self._pos - self._base
+        return bytes(self._buf[start:start + n])
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("cannot seek from the end")
+        if offset < self._base:
+            raise io.UnsupportedOperation(
+                f"cannot seek back to {offset}, {self._base} is the earliest "
+                f"offset still buffered")
+        self._pos = offset
+        return offset
+
+    def seekable(self):
+        # not in the sense that callers may jump around freely
+        return False
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._raw.close()
@@ -0,0 +1,405 @@
+import sys
+import threading
+from array import array
+from enum import Enum
+from importlib import import_module
+from struct import Struct
+
+from util.binfile import (BuildEnum, LazyArray, Structure, _filelock,
+                          _instantiated)
+
+# Compact tagged binary encoding of parsed Structure trees, for caches and
+# for handing trees to other processes. Classes are not pickled by name:
+# a type table up front describes each one the way it is rebuilt (import
+# path, template arguments, BuildEnum arguments), nodes refer to it by
+# index. All little-endian:
+#
+#   header   MAGIC, number of types
+#   types    kind 'c' module, qualname | 't' base, (pattern, arg)... |
+#            'e' int type, enum; then the names of the slots encoded
+#   value    one tag byte, then
+#              N T F                       None, True, False
+#              i  q                        int
+#              n  type, q                  int subclass (UInt32, enums...)
+#              m  type, str                ... too big for q
+#              s  str / b  bytes           u32 length, data
+#              a  u32 count, q...          field offsets (_offs)
+#              l  type, u32 size, count    list (Array), then the items
+#              z  type, u32 count, q...    LazyArray, offsets of the items
+#                                          in the file it was parsed from
+#              o  type, u32 size, count    Structure, then (u16 slot,
+#                                          value) for every slot set
+#
+# Sizes of l and o are in bytes, so that a lazy decode can step over them.
+# A LazyArray stays lazy: decoding one needs the file it was parsed from.
+
+MAGIC = b'STRC\1\0'
+U16 = Struct('<H')
+U32 = Struct('<I')
+I64 = Struct('<q')
+TYPEINT = Struct('<Iq')
+HEAD = Struct('<III')  # type, size, count
+
+# parse state that is meaningless once parsing is done
+TRANSIENT = frozenset(('_file', '_maxfin', '_fin', '_lazy', '_starts',
+                       '_init_common', '_cache', '_lock'))
+
+_INT_MIN, _INT_MAX = -1 << 63, (1 << 63) - 1
+_SWAP = sys.byteorder != 'little'
+
+
+def _str(s):
+    s = s.encode('utf-8')
+    return U32.pack(len(s)) + s
+
+
+class Encoder:
+    def __init__(self):
+        self.types = {}  # class -> (index, slot plan)
+        self.kinds = {}
+        self.table = bytearray()
+        self.out = bytearray()
+
+    def typeid(self, cls):
+        try:
+            return self.types[cls][0]
+        except KeyError:
+            pass
+        recipe = cls.__dict__.get('_recipe')
+        if recipe is None:
+            entry = b'c' + _str(cls.__module__) + _str(cls.__qualname__)
+        elif recipe[0] is _instantiated:
+            base, args = recipe[1]
+            entry = b't' + U32.pack(self.typeid(base)) + U32.pack(len(args))
+            for pattern, arg in args:
+                entry += _str(pattern)
+                if isinstance(arg, str):
+                    entry += b's' + _str(arg)
+                else:
+                    entry += b't' + U32.pack(self.typeid(arg))
+        elif recipe[0] is BuildEnum:
+            ft, enum = recipe[1]
+            entry = (b'e' + U32.pack(self.typeid(ft))
+                     + U32.pack(self.typeid(enum)))
+        else:
+            raise TypeError(f"cannot encode class {cls.__qualname__}")
+        names = ()
+        if issubclass(cls, Structure) and not issubclass(cls, (int, list)):
+            names = tuple(n for n in cls._allslots if n not in TRANSIENT)
+        entry += U16.pack(len(names)) + b''.join(map(_str, names))
+        idx = len(self.types)
+        # slot descriptors, read directly: no class defaults, no lazy
+        # decoding, unless the slot is empty
+        plan = tuple((i, U16.pack(i), name, getattr(cls, name).__get__)
+                     for i, name in enumerate(names))
+        self.types[cls] = idx, plan
+        self.table += entry
+        return idx
+
+    def kind(self, tp):
+        try:
+            return self.kinds[tp]
+        except KeyError:
+            pass
+        if tp is type(None):
+            kind = 'none'
+        elif tp is bool:
+            kind = 'bool'
+        elif tp is int:
+            kind = 'int'
+        elif issubclass(tp, int):
+            kind = 'typedint'
+        elif tp is str:
+            kind = 'str'
+        elif issubclass(tp, (bytes, bytearray, memoryview)):
+            kind = 'bytes'
+        elif tp is array:
+            kind = 'array'
+        elif issubclass(tp, LazyArray):
+            kind = 'lazy'
+        elif issubclass(tp, list):
+            kind = 'list'
+        elif issubclass(tp, Structure):
+            kind = 'struct'
+        else:
+            raise TypeError(f"cannot encode {tp.__qualname__}")
+        self.kinds[tp] = kind
+        return kind
+
+    def value(self, v):
+        out = self.out
+        tp = type(v)
+        kind = self.kinds.get(tp) or self.kind(tp)
+        if kind == 'typedint':
+            tid = self.typeid(tp)
+            if _INT_MIN <= v <= _INT_MAX:
+                out += b'n' + TYPEINT.pack(tid, v)
+            else:
+                out += b'm' + U32.pack(tid) + _str(str(int(v)))
+        elif kind == 'struct':
+            self.struct(v, tp)
+        elif kind == 'int':
+            if _INT_MIN <= v <= _INT_MAX:
+                out += b'i' + I64.pack(v)
+            else:
+                out += b'm' + U32.pack(self.typeid(int)) + _str(str(v))
+        elif kind == 'str':
+            out += b's' + _str(v)
+        elif kind == 'none':
+            out += b'N'
+        elif kind == 'bool':
+            out += b'T' if v else b'F'
+        elif kind == 'bytes':
+            out += b'b' + U32.pack(len(v)) + v
+        elif kind == 'array':
+            if _SWAP:
+                v = array(v.typecode, v)
+                v.byteswap()
+            out += b'a' + U32.pack(len(v)) + v.tobytes()
+        elif kind == 'lazy':
+            starts = array('q', v._starts)
+            if _SWAP:
+                starts.byteswap()
+            out += (b'z' + U32.pack(self.typeid(tp)) + U32.pack(len(starts))
+                    + starts.tobytes())
+        else:
+            tid = self.typeid(tp)
+            at = len(out)
+            out += b'l' + HEAD.pack(tid, 0, len(v))
+            for item in v:
+                self.value(item)
+            HEAD.pack_into(out, at + 1, tid, len(out) - at - 13, len(v))
+
+    def struct(self, v, tp):
+        out = self.out
+        tid = self.typeid(tp)
+        at = len(out)
+        out += b'o' + HEAD.pack(tid, 0, 0)
+        count = 0
+        for i, packed, name, get in self.types[tp][1]:
+            try:
+                item = get(v)
+            except AttributeError:
+                item = v._value(name, _MISSING)
+                if item is _MISSING:
+                    continue
+            out += packed
+            self.value(item)
+            count += 1
+        HEAD.pack_into(out, at + 1, tid, len(out) - at - 13, count)
+
+
+_MISSING = object()
+
+
+def dumps(tree):
+    enc = Encoder()
+    enc.value(tree)
+    return (MAGIC + U32.pack(len(enc.types)) + bytes(enc.table)
+            + bytes(enc.out))
+
+
+def _intmaker(cls):
+    if issubclass(cls, Enum):
+        members = cls._value2member_map_
+
+        def member(val):
+            try:
+                return members[val]
+            except KeyError:
+                return cls(val)
+        return member
+    if issubclass(cls, int) and cls is not bool:
+        # BaseType and friends: no need to go through their parsing __new__
+        return lambda val: int.__new__(cls, val)
+    return cls
+
+
+def _resolve(module, qualname):
+    obj = import_module(module)
+    for part in qualname.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+class Decoder:
+    def __init__(self, data, lazy=False, fileobj=None):
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        self.buf = data
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("not an encoded Structure tree")
+        self.lazy = lazy
+        self.fileobj = fileobj
+        # lazily decoded fields may be asked for from several threads
+        self.lock = threading.Lock()
+        ntypes, = U32.unpack_from(data, len(MAGIC))
+        self.off = len(MAGIC) + 4
+        self.types = []
+        self.ints = []  # how to make a typed int of each type
+        self.names = []
+        for _ in range(ntypes):
+            kind = self._bytes(1)
+            if kind == b'c':
+                cls = _resolve(self._text(), self._text())
+            elif kind == b't':
+                base = self.types[self._u32()]
+                args = []
+                for _ in range(self._u32()):
+                    pattern = self._text()
+                    if self._bytes(1) == b's':
+                        args.append((pattern, self._text()))
+                    else:
+                        args.append((pattern, self.types[self._u32()]))
+                cls = _instantiated(base, tuple(args))
+            elif kind == b'e':
+                ft = self.types[self._u32()]
+                cls = BuildEnum(ft, self.types[self._u32()])
+            else:
+                raise ValueError(f"unknown type kind {kind!r}")
+            count, = U16.unpack_from(data, self.off)
+            self.off += 2
+            self.types.append(cls)
+            self.ints.append(_intmaker(cls))
+            self.names.append(tuple(self._text() for _ in range(count)))
+
+    def _u32(self):
+        val, = U32.unpack_from(self.buf, self.off)
+        self.off += 4
+        return val
+
+    def _bytes(self, n):
+        ret = bytes(self.buf[self.off:self.off + n])
+        self.off += n
+        return ret
+
+    def _text(self):
+        return str(self._bytes(self._u32()), 'utf-8')
+
+    def value(self):
+        buf = self.buf
+        tag = buf[self.off]
+        self.off += 1
+        if tag == 0x69:  # i
+            val, = I64.unpack_from(buf, self.off)
+            self.off += 8
+            return val
+        if tag == 0x6e:  # n
+            tid, val = TYPEINT.unpack_from(buf, self.off)
+            self.off += 12
+            return self.ints[tid](val)
+        if tag == 0x6f:  # o
+            return self._struct()
+        if tag == 0x73:  # s
+            return self._text()
+        if tag == 0x62:  # b
+            return self._bytes(self._u32())
+        if tag == 0x4e:  # N
+            return None
+        if tag == 0x6c:  # l
+            tid, size, count = HEAD.unpack_from(buf, self.off)
+            self.off += 12
+            cls = self.types[tid]
+            items = [self.value() for _ in range(count)]
+            if cls is list:
+                return items
+            ret = list.__new__(cls)
+            ret.extend(items)
+            return ret
+        if tag == 0x61:  # a
+            count = self._u32()
+            ret = array('q')
+            ret.frombytes(self._bytes(8 * count))
+            if _SWAP:
+                ret.byteswap()
+            return ret
+        if tag == 0x7a:  # z
+            return self._lazyarray()
+        if tag == 0x54:  # T
+            return True
+        if tag == 0x46:  # F
+            return False
+        if tag == 0x6d:  # m
+            return self.types[self._u32()](int(self._text()))
+        raise ValueError(f"unknown tag {tag:#x} at offset {self.off - 1}")
+
+    def _lazyarray(self):
+        cls = self.types[self._u32()]
+        if self.fileobj is None:
+            raise ValueError(f"{cls.__name__} is read from the file it was "
+                             f"parsed from, which was not given")
+        starts = array('q')
+        starts.frombytes(self._bytes(8 * self._u32()))
+        if _SWAP:
+            starts.byteswap()
+        ret = cls()
+        ret._starts = starts.tolist()
+        ret._file = self.fileobj
+        ret._lock = _filelock(self.fileobj)
+        return ret
+
+    def _struct(self):
+        buf = self.buf
+        tid, size, count = HEAD.unpack_from(buf, self.off)
+        off = self.off + 12
+        names = self.names[tid]
+        obj = object.__new__(self.types[tid])
+        pending = None
+        for _ in range(count):
+            name = names[buf[off] | buf[off + 1] << 8]
+            tag = buf[off + 2]
+            if tag == 0x6e:  # n, by far the most common
+                tid, val = TYPEINT.unpack_from(buf, off + 3)
+                setattr(obj, name, self.ints[tid](val))
+                off += 15
+                continue
+            if tag == 0x61:  # a, in every parsed Structure
+                n = 8 * (buf[off + 3] | buf[off + 4] << 8
+                         | buf[off + 5] << 16 | buf[off + 6] << 24)
+                offs = array('q')
+                offs.frombytes(buf[off + 7:off + 7 + n])
+                if _SWAP:
+                    offs.byteswap()
+                setattr(obj, name, offs)
+                off += 7 + n
+                continue
+            if self.lazy and (tag == 0x6c or tag == 0x6f):  # l, o
+                if pending is None:
+                    pending = {}
+                pending[name] = off + 2
+                off += 15 + HEAD.unpack_from(buf, off + 3)[1]
+                continue
+            self.off = off + 2
+            val = self.value()
+            if tag == 0x7a and hasattr(obj, 'init_common'):  # z
+                # as when it was parsed
+                val._init_common = obj.init_common
+            setattr(obj, name, val)
+            off = self.off
+        self.off = off
+        if pending:
+            obj._lazy = self, pending
+        return obj
+
+    def resolve(self, obj, field, pending, default):
+        # decode a lazily decoded field of obj, once
+        with self.lock:
+            try:
+                return object.__getattribute__(obj, field)
+            except AttributeError:
+                pass
+            try:
+                self.off = pending.pop(field)
+            except KeyError:
+                return default
+            val = self.value()
+            setattr(obj, field, val)
+            return val
+
+
+def loads(data, lazy=False, fileobj=None):
+    # lazy: nested Structures and lists are only decoded when first
+    # accessed, everything else right away; fileobj: the file the tree
+    # was parsed from, for its LazyArrays to read their items from
+    dec = Decoder(data, lazy, fileobj)
+    return dec.value()